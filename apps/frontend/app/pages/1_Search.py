@@ -14,12 +14,12 @@ from langchain_core.prompts import ChatPromptTemplate
 
 
 try:
-    from utils import get_search_results
+    from utils import get_search_results, pack_context
     from prompts import DOCSEARCH_PROMPT_TEXT
 except Exception as e:
     # Add the path four levels up
     sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../../../')))
-    from common.utils import get_search_results
+    from common.utils import get_search_results, pack_context
     from common.prompts import DOCSEARCH_PROMPT_TEXT
 
 
@@ -131,7 +131,8 @@ else:
                                 )
                                 
     
-                                answer = chain.invoke({"question": query, "context":str(top_docs)})
+                                context, _ = pack_context(top_docs)
+                                answer = chain.invoke({"question": query, "context": context})
                                 
                             else:
                                 answer = {"output_text":"No results found" }
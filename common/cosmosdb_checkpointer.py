@@ -1,13 +1,18 @@
 import logging
 import base64
-import json
+import copy
 import threading
 import asyncio
 import time
+import weakref
+import zlib
+from contextlib import AsyncExitStack, asynccontextmanager
 from typing import Any, Dict, Iterator, AsyncIterator, Optional, Sequence, Tuple, List
 from types import TracebackType
 from abc import ABC, abstractmethod
+from collections import OrderedDict
 
+from azure.core import MatchConditions
 from azure.cosmos import CosmosClient, PartitionKey, exceptions
 from azure.cosmos.aio import CosmosClient as AsyncCosmosClient
 from azure.cosmos.exceptions import CosmosBatchOperationError
@@ -28,6 +33,16 @@ from contextlib import AbstractContextManager, AbstractAsyncContextManager
 from langchain_core.runnables import RunnableConfig
 from typing_extensions import Self
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
 # Set up logging
 logger = logging.getLogger(__name__)
 
@@ -40,12 +55,213 @@ METADATA = "metadata"
 CHECKPOINT = "checkpoint"
 CHECKPOINT_ENCODED = "checkpoint_encoded"
 METADATA_ENCODED = "metadata_encoded"
+# Codec tags of fields written by CheckpointCodec (docs without them use the legacy encoding)
+CHECKPOINT_CODEC = "checkpoint_codec"
+METADATA_CODEC = "metadata_codec"
+VALUE_CODEC = "value_codec"
+# Uncompressed size of the serialized checkpoint and metadata, the weight of the entry in CheckpointCache
+CHECKPOINT_SIZE = "checkpoint_size"
+# Per-thread head pointer document (id = thread_id) holding the id of the latest checkpoint
+HEAD_DOC = "head"
+
+LATEST_CHECKPOINT_QUERY = (
+    "SELECT * FROM c WHERE c.thread_id = @thread_id AND IS_DEFINED(c.checkpoint) "
+    "ORDER BY c.checkpoint_id DESC OFFSET 0 LIMIT 1"
+)
+
+# Returned by read_item when a conditional (etag) read finds the item unchanged
+NOT_MODIFIED = object()
+
+
+class _BatchFallback(Exception):
+    """Raised when a transactional batch is rejected as a whole, so its items are upserted one by one instead."""
+
+
+def _response_etag(response: Any) -> Optional[str]:
+    """ETag of an upserted item, from either an upsert response or a transactional batch result."""
+    if not isinstance(response, dict):
+        return None
+    return response.get("_etag") or response.get("eTag") or (response.get("resourceBody") or {}).get("_etag")
+
+
+class CheckpointCodec:
+    """
+    Turns the serde's typed encoding (serde.dumps_typed, msgpack for JsonPlusSerializer) into a string
+    that fits in a Cosmos DB document, compressing payloads above a size threshold.
+
+    The returned tag records how the field was written, e.g. "msgpack+zstd" or "json", and is stored next
+    to it so any codec can read documents written with other settings. Everything but uncompressed JSON is
+    base64-encoded. Compression is zstd or lz4 when installed, zlib otherwise ("auto" picks the first
+    available), or None to disable it.
+    """
+
+    COMPRESSORS = ("zstd", "lz4", "zlib")
+
+    def __init__(self, compression: Optional[str] = "auto", threshold: int = 1024, level: Optional[int] = None):
+        if compression == "auto":
+            compression = next(name for name in self.COMPRESSORS if self._available(name))
+        elif compression is not None and not self._available(compression):
+            raise ValueError(f"Compression '{compression}' is not available, install it or use one of "
+                             f"{[name for name in self.COMPRESSORS if self._available(name)]}")
+        self.compression = compression
+        self.threshold = threshold
+        self.level = level
+
+    @staticmethod
+    def _available(name: str) -> bool:
+        return {"zstd": zstandard is not None, "lz4": lz4 is not None, "zlib": True}.get(name, False)
+
+    def _compress(self, data: bytes) -> bytes:
+        if self.compression == "zstd":
+            return zstandard.ZstdCompressor(level=self.level or 3).compress(data)
+        if self.compression == "lz4":
+            return lz4.frame.compress(data, compression_level=self.level or 0)
+        return zlib.compress(data, self.level or 6)
+
+    @staticmethod
+    def _decompress(name: str, data: bytes) -> bytes:
+        if name == "zstd":
+            if zstandard is None:
+                raise ValueError("Field was compressed with zstd but zstandard is not installed")
+            return zstandard.ZstdDecompressor().decompress(data)
+        if name == "lz4":
+            if lz4 is None:
+                raise ValueError("Field was compressed with lz4 but lz4 is not installed")
+            return lz4.frame.decompress(data)
+        if name == "zlib":
+            return zlib.decompress(data)
+        raise ValueError(f"Unknown compression '{name}'")
+
+    def encode(self, typed: Tuple[str, bytes]) -> Tuple[str, str, int]:
+        """Returns (tag, data, uncompressed size in bytes) for the output of serde.dumps_typed."""
+        type_, payload = typed
+        tag, size = type_, len(payload)
+        if self.compression and len(payload) >= self.threshold:
+            compressed = self._compress(payload)
+            # Keep the raw payload if compression doesn't pay off
+            if len(compressed) < len(payload):
+                tag, payload = f"{type_}+{self.compression}", compressed
+        if tag == "json":
+            return tag, payload.decode("utf-8"), size
+        return tag, base64.b64encode(payload).decode("ascii"), size
+
+    def decode(self, tag: str, data: str) -> Tuple[str, bytes]:
+        """Inverse of encode, returns the input for serde.loads_typed."""
+        if tag == "json":
+            return tag, data.encode("utf-8")
+        type_, _, compression = tag.partition("+")
+        payload = base64.b64decode(data)
+        if compression:
+            payload = self._decompress(compression, payload)
+        return type_, payload
+
+
+class CheckpointCache:
+    """
+    Thread-safe LRU cache of deserialized CheckpointTuples keyed by (thread_id, checkpoint_id),
+    bounded by the serialized size of the entries in bytes and a per-entry TTL.
+
+    Checkpoint documents are immutable once written, so entries looked up by id are served directly.
+    For the latest checkpoint of a thread the cache also remembers the ETag of the thread's head
+    pointer; the saver revalidates it with a conditional read, so a checkpoint written by another
+    replica is never hidden by a cached one.
+    """
+
+    def __init__(self, max_bytes: int = 64 << 20, ttl: Optional[float] = 300):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()  # (thread_id, checkpoint_id) -> (expires_at, size, checkpoint_tuple)
+        # thread_id -> (checkpoint_id, head etag), only kept while that checkpoint's entry is cached
+        self._latest: Dict[str, Tuple[str, str]] = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.validations = 0
+        self.evictions = 0
+
+    def get(self, thread_id: str, checkpoint_id: str) -> Optional[CheckpointTuple]:
+        key = (thread_id, checkpoint_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] is not None and entry[0] < time.monotonic():
+                self._pop(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        # Hand out a copy so callers can't mutate the cached checkpoint
+        return copy.deepcopy(entry[2])
+
+    def set(self, checkpoint_tuple: CheckpointTuple, size: int) -> None:
+        if size > self.max_bytes:
+            return
+        configurable = checkpoint_tuple.config[CONFIGURABLE]
+        key = (configurable[THREAD_ID], configurable[CHECKPOINT_ID])
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        checkpoint_tuple = copy.deepcopy(checkpoint_tuple)
+        with self._lock:
+            # Same checkpoint, so a head pointer to it stays valid
+            self._pop(key, forget_latest=False)
+            self._entries[key] = (expires_at, size, checkpoint_tuple)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                self._pop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _pop(self, key: Tuple[str, str], forget_latest: bool = True) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+        thread_id, checkpoint_id = key
+        if forget_latest and self._latest.get(thread_id, (None,))[0] == checkpoint_id:
+            del self._latest[thread_id]
+
+    def latest(self, thread_id: str) -> Optional[Tuple[str, str]]:
+        """Returns (checkpoint_id, head etag) of the last known head of the thread."""
+        with self._lock:
+            return self._latest.get(thread_id)
+
+    def set_latest(self, thread_id: str, checkpoint_id: str, etag: Optional[str]) -> None:
+        with self._lock:
+            if etag and (thread_id, checkpoint_id) in self._entries:
+                self._latest[thread_id] = (checkpoint_id, etag)
+            else:
+                self._latest.pop(thread_id, None)
+
+    def record_validation(self) -> None:
+        with self._lock:
+            self.validations += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._latest.clear()
+            self._bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "validations": self.validations, "entries": len(self._entries), "threads": len(self._latest),
+                "bytes": self._bytes, "max_bytes": self.max_bytes, "evictions": self.evictions}
+
 
 class BaseCosmosDBSaver(ABC, BaseCheckpointSaver):
     """Abstract base class for CosmosDB Savers with shared logic."""
 
     serde: SerializerProtocol
     
+    # Cosmos DB limit on the number of operations in one transactional batch
+    MAX_BATCH_OPERATIONS = 100
+    # Statuses that make a batch unusable (payload too large), so its items are upserted one by one instead
+    BATCH_FALLBACK_STATUSES = (413,)
+    
     DEFAULT_INDEXING_POLICY = {
         "indexingMode": "consistent",
         "automatic": True,
@@ -98,12 +314,18 @@ class BaseCosmosDBSaver(ABC, BaseCheckpointSaver):
         database_name: str,
         container_name: str,
         serde: Optional[SerializerProtocol] = None,
+        cache_max_bytes: Optional[int] = None,
+        cache_ttl: Optional[float] = 300,
+        codec: Optional[CheckpointCodec] = None,
     ) -> None:
         super().__init__(serde=serde or JsonPlusSerializer())
         self.database_name = database_name
         self.container_name = container_name
         self.database = None
         self.container = None
+        self.codec = codec or CheckpointCodec()
+        # Optional in-process checkpoint cache, enabled by giving it a size budget
+        self.cache = CheckpointCache(max_bytes=cache_max_bytes, ttl=cache_ttl) if cache_max_bytes else None
 
     def setup(self) -> None:
         """
@@ -120,13 +342,21 @@ class BaseCosmosDBSaver(ABC, BaseCheckpointSaver):
         return self.DEFAULT_INDEXING_POLICY
     
     @abstractmethod
-    def upsert_item(self, doc: Dict[str, Any]) -> None:
-        """Abstract method to upsert an item into the database."""
+    def upsert_item(self, doc: Dict[str, Any]) -> Dict[str, Any]:
+        """Abstract method to upsert an item into the database. Returns the service's response."""
         pass
     
     @abstractmethod
-    def upsert_items(self, docs: List[Dict[str, Any]]) -> None:
-        """Abstract method to upsert multiple items into the database."""
+    def upsert_items(self, docs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Abstract method to upsert multiple items into the database. Returns the responses in input order."""
+        pass
+
+    @abstractmethod
+    def read_item(self, item_id: str, partition_key: str, etag: Optional[str] = None) -> Any:
+        """
+        Abstract method to point-read an item by id and partition key. Returns None if it doesn't exist,
+        or NOT_MODIFIED if an etag is given and the item still has it.
+        """
         pass
 
     @abstractmethod
@@ -134,27 +364,33 @@ class BaseCosmosDBSaver(ABC, BaseCheckpointSaver):
         self,
         query: str,
         parameters: Optional[List[Dict[str, Any]]] = None,
+        partition_key: Optional[str] = None,
     ) -> Iterator[Dict[str, Any]]:
-        """Abstract method to query items from the database."""
+        """Abstract method to query items from the database (within one partition if partition_key is given)."""
         pass
 
-    def _serialize_field(self, data: Any) -> Tuple[Any, bool]:
-        """Helper method to serialize and conditionally encode data."""
-        serialized = self.serde.dumps(data)
-        encoded = False
-        try:
-            json.dumps(serialized)
-            data_out = serialized
-        except (TypeError, ValueError):
-            if isinstance(serialized, str):
-                serialized = serialized.encode('utf-8')
-            data_out = base64.b64encode(serialized).decode('utf-8')
-            encoded = True
-        return data_out, encoded
-
-    def _deserialize_field(self, doc: Dict[str, Any], field_name: str, encoded_flag_name: str) -> Any:
+    def _batch_groups(self, docs: List[Dict[str, Any]]) -> Iterator[Tuple[str, List[int]]]:
+        """Groups the positions of docs by partition key (thread_id) into chunks that fit in one transactional batch."""
+        partitions: Dict[str, List[int]] = {}
+        for position, doc in enumerate(docs):
+            partitions.setdefault(doc[THREAD_ID], []).append(position)
+        for partition_key, positions in partitions.items():
+            for i in range(0, len(positions), self.MAX_BATCH_OPERATIONS):
+                yield partition_key, positions[i:i + self.MAX_BATCH_OPERATIONS]
+
+    def _serialize_field(self, data: Any) -> Tuple[str, str, int]:
+        """Helper method to serialize data with the serde's typed encoding. Returns (data, codec tag, uncompressed size)."""
+        tag, data_out, size = self.codec.encode(self.serde.dumps_typed(data))
+        return data_out, tag, size
+
+    def _deserialize_field(self, doc: Dict[str, Any], field_name: str, encoded_flag_name: str, codec_name: str) -> Any:
         """Helper method to deserialize a field from the document."""
         data = doc[field_name]
+        tag = doc.get(codec_name)
+        if tag:
+            return self.serde.loads_typed(self.codec.decode(tag, data))
+
+        # Legacy documents: serde.dumps output, base64-encoded when it wasn't JSON-safe
         encoded = doc.get(encoded_flag_name, False)
         if encoded:
             serialized = base64.b64decode(data.encode('utf-8'))
@@ -162,7 +398,147 @@ class BaseCosmosDBSaver(ABC, BaseCheckpointSaver):
             serialized = data
             if isinstance(serialized, str):
                 serialized = serialized.encode('utf-8')
-        return self.serde.loads(serialized)
+        if hasattr(self.serde, "loads"):
+            return self.serde.loads(serialized)
+        return self.serde.loads_typed(("json", serialized))
+
+    def _doc_to_tuple(self, doc: Dict[str, Any]) -> CheckpointTuple:
+        """Builds a CheckpointTuple from a checkpoint document."""
+        checkpoint = self._deserialize_field(doc, CHECKPOINT, CHECKPOINT_ENCODED, CHECKPOINT_CODEC)
+        metadata = self._deserialize_field(doc, METADATA, METADATA_ENCODED, METADATA_CODEC)
+        return self._make_tuple(doc, checkpoint, metadata)
+
+    @staticmethod
+    def _make_tuple(doc: Dict[str, Any], checkpoint: Checkpoint, metadata: CheckpointMetadata) -> CheckpointTuple:
+        parent_checkpoint_id = doc.get(PARENT_CHECKPOINT_ID)
+        parent_config = (
+            {
+                CONFIGURABLE: {
+                    THREAD_ID: doc[THREAD_ID],
+                    CHECKPOINT_ID: parent_checkpoint_id,
+                }
+            }
+            if parent_checkpoint_id
+            else None
+        )
+        return CheckpointTuple(
+            {
+                CONFIGURABLE: {
+                    THREAD_ID: doc[THREAD_ID],
+                    CHECKPOINT_ID: doc[CHECKPOINT_ID],
+                }
+            },
+            checkpoint,
+            metadata,
+            parent_config,
+        )
+
+    def _checkpoint_doc(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata) -> Dict[str, Any]:
+        """Builds the document stored for a checkpoint."""
+        thread_id = config.get(CONFIGURABLE, {}).get(THREAD_ID)
+        if not thread_id:
+            raise ValueError(f"'{THREAD_ID}' is required in config['{CONFIGURABLE}']")
+        checkpoint_id = checkpoint.get("id")
+        if not checkpoint_id:
+            raise ValueError("Checkpoint must have an 'id' field")
+
+        # Serialize checkpoint and metadata
+        checkpoint_data, checkpoint_codec, checkpoint_size = self._serialize_field(checkpoint)
+        metadata_data, metadata_codec, metadata_size = self._serialize_field(metadata)
+
+        # Use checkpoint_id as the document ID to ensure uniqueness
+        doc = {
+            "id": checkpoint_id,
+            THREAD_ID: thread_id,
+            CHECKPOINT_ID: checkpoint_id,
+            CHECKPOINT: checkpoint_data,
+            METADATA: metadata_data,
+            CHECKPOINT_CODEC: checkpoint_codec,
+            METADATA_CODEC: metadata_codec,
+            CHECKPOINT_SIZE: checkpoint_size + metadata_size,
+        }
+        parent_checkpoint_id = config.get(CONFIGURABLE, {}).get(CHECKPOINT_ID)
+        if parent_checkpoint_id:
+            doc[PARENT_CHECKPOINT_ID] = parent_checkpoint_id
+        return doc
+
+    @staticmethod
+    def _head_doc(doc: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Head pointer for the checkpoint's thread. It only holds the ids (nested, so the head never matches
+        the checkpoint queries), which keeps the write small and the latest checkpoint two point reads away.
+        """
+        head = {CHECKPOINT_ID: doc[CHECKPOINT_ID]}
+        if doc.get(PARENT_CHECKPOINT_ID):
+            head[PARENT_CHECKPOINT_ID] = doc[PARENT_CHECKPOINT_ID]
+        return {"id": doc[THREAD_ID], THREAD_ID: doc[THREAD_ID], HEAD_DOC: head}
+
+    @staticmethod
+    def _config_ids(config: RunnableConfig) -> Tuple[str, Optional[str]]:
+        thread_id = config.get(CONFIGURABLE, {}).get(THREAD_ID)
+        if not thread_id:
+            raise ValueError(f"'{THREAD_ID}' is required in config['{CONFIGURABLE}']")
+        return thread_id, get_checkpoint_id(config)
+
+    @staticmethod
+    def _doc_size(doc: Dict[str, Any]) -> int:
+        """In-memory weight of a checkpoint: the uncompressed size of its serialized fields."""
+        # Documents written before CHECKPOINT_SIZE existed were never compressed, so their field lengths are close
+        return doc.get(CHECKPOINT_SIZE) or len(doc[CHECKPOINT]) + len(doc[METADATA])
+
+    def _cache_doc(self, doc: Optional[Dict[str, Any]]) -> Optional[CheckpointTuple]:
+        """Deserializes a checkpoint doc read from the database and stores it in the cache (if enabled)."""
+        if doc is None:
+            return None
+        checkpoint_tuple = self._doc_to_tuple(doc)
+        if self.cache is not None:
+            self.cache.set(checkpoint_tuple, self._doc_size(doc))
+        return checkpoint_tuple
+
+    def _cache_put(self, doc: Dict[str, Any], checkpoint: Checkpoint, metadata: CheckpointMetadata,
+                   head_response: Any) -> None:
+        """Write-through: caches a checkpoint just saved together with the new ETag of its head pointer."""
+        if self.cache is None:
+            return
+        self.cache.set(self._make_tuple(doc, checkpoint, metadata), self._doc_size(doc))
+        self.cache.set_latest(doc[THREAD_ID], doc[CHECKPOINT_ID], _response_etag(head_response))
+
+    def _head_target(self, latest: Optional[Tuple[str, str]], head: Any) -> Tuple[Optional[str], Optional[str]]:
+        """Returns (checkpoint_id, head etag) the thread's head points to, or (None, None) if it has no head."""
+        if head is NOT_MODIFIED:
+            # The head still has the cached ETag, so it still points to the cached checkpoint id
+            self.cache.record_validation()
+            return latest
+        if head is not None and HEAD_DOC in head:
+            return head[HEAD_DOC][CHECKPOINT_ID], head.get("_etag")
+        return None, None
+
+    def _read_checkpoint(self, thread_id: str, checkpoint_id: Optional[str]) -> Optional[CheckpointTuple]:
+        """
+        Reads a checkpoint by id, or the latest one through the thread's head pointer, from the cache when possible.
+        The head is always read (conditionally on its cached ETag), so checkpoints written by other replicas are seen.
+        """
+        if checkpoint_id:
+            if self.cache is not None:
+                cached = self.cache.get(thread_id, checkpoint_id)
+                if cached is not None:
+                    return cached
+            doc = self.read_item(checkpoint_id, thread_id)
+            return self._cache_doc(doc if doc is not None and CHECKPOINT in doc else None)
+
+        latest = self.cache.latest(thread_id) if self.cache is not None else None
+        head = self.read_item(thread_id, thread_id, etag=latest[1] if latest else None)
+        checkpoint_id, head_etag = self._head_target(latest, head)
+        if checkpoint_id:
+            checkpoint_tuple = self._read_checkpoint(thread_id, checkpoint_id)
+            if checkpoint_tuple is not None:
+                if self.cache is not None:
+                    self.cache.set_latest(thread_id, checkpoint_id, head_etag)
+                return checkpoint_tuple
+        # Threads written before head pointers existed: single-partition query
+        parameters = [{"name": "@thread_id", "value": thread_id}]
+        results = list(self.query_items(query=LATEST_CHECKPOINT_QUERY, parameters=parameters, partition_key=thread_id))
+        return self._cache_doc(results[0] if results else None)
 
     def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
         """
@@ -181,53 +557,8 @@ class BaseCosmosDBSaver(ABC, BaseCheckpointSaver):
             >>> config = {"configurable": {"thread_id": "thread1"}}
             >>> checkpoint_tuple = saver.get_tuple(config)
         """
-        thread_id = config.get(CONFIGURABLE, {}).get(THREAD_ID)
-        if not thread_id:
-            raise ValueError(f"'{THREAD_ID}' is required in config['{CONFIGURABLE}']")
-        checkpoint_id = get_checkpoint_id(config)
-        parameters = [{"name": "@thread_id", "value": thread_id}]
-        if checkpoint_id:
-            query = (
-                "SELECT * FROM c WHERE c.thread_id = @thread_id AND IS_DEFINED(c.checkpoint) "
-                "AND c.checkpoint_id = @checkpoint_id"
-            )
-            parameters.append({"name": "@checkpoint_id", "value": checkpoint_id})
-        else:
-            query = (
-                "SELECT * FROM c WHERE c.thread_id = @thread_id AND IS_DEFINED(c.checkpoint) "
-                "ORDER BY c.checkpoint_id DESC OFFSET 0 LIMIT 1"
-            )
-
-        items = self.query_items(query=query, parameters=parameters)
-        results = list(items)
-        if results:
-            doc = results[0]
-            checkpoint = self._deserialize_field(doc, CHECKPOINT, CHECKPOINT_ENCODED)
-            metadata = self._deserialize_field(doc, METADATA, METADATA_ENCODED)
-            parent_checkpoint_id = doc.get(PARENT_CHECKPOINT_ID)
-            parent_config = (
-                {
-                    CONFIGURABLE: {
-                        THREAD_ID: doc[THREAD_ID],
-                        CHECKPOINT_ID: parent_checkpoint_id,
-                    }
-                }
-                if parent_checkpoint_id
-                else None
-            )
-            return CheckpointTuple(
-                {
-                    CONFIGURABLE: {
-                        THREAD_ID: doc[THREAD_ID],
-                        CHECKPOINT_ID: doc[CHECKPOINT_ID],
-                    }
-                },
-                checkpoint,
-                metadata,
-                parent_config,
-            )
-        else:
-            return None
+        thread_id, checkpoint_id = self._config_ids(config)
+        return self._read_checkpoint(thread_id, checkpoint_id)
 
     def list(
         self,
@@ -251,6 +582,7 @@ class BaseCosmosDBSaver(ABC, BaseCheckpointSaver):
         """
         parameters = []
         conditions = []
+        thread_id = None
         if config is not None:
             thread_id = config.get(CONFIGURABLE, {}).get(THREAD_ID)
             if not thread_id:
@@ -277,32 +609,9 @@ class BaseCosmosDBSaver(ABC, BaseCheckpointSaver):
 
         query = f"SELECT * FROM c WHERE {where_clause} {order_clause} {limit_clause}"
 
-        items = self.query_items(query=query, parameters=parameters)
+        items = self.query_items(query=query, parameters=parameters, partition_key=thread_id)
         for doc in items:
-            checkpoint = self._deserialize_field(doc, CHECKPOINT, CHECKPOINT_ENCODED)
-            metadata = self._deserialize_field(doc, METADATA, METADATA_ENCODED)
-            parent_checkpoint_id = doc.get(PARENT_CHECKPOINT_ID)
-            parent_config = (
-                {
-                    CONFIGURABLE: {
-                        THREAD_ID: doc[THREAD_ID],
-                        CHECKPOINT_ID: parent_checkpoint_id,
-                    }
-                }
-                if parent_checkpoint_id
-                else None
-            )
-            yield CheckpointTuple(
-                {
-                    CONFIGURABLE: {
-                        THREAD_ID: doc[THREAD_ID],
-                        CHECKPOINT_ID: doc[CHECKPOINT_ID],
-                    }
-                },
-                checkpoint,
-                metadata,
-                parent_config,
-            )
+            yield self._doc_to_tuple(doc)
 
     def put(
         self,
@@ -326,39 +635,16 @@ class BaseCosmosDBSaver(ABC, BaseCheckpointSaver):
         Raises:
             ValueError: If required fields are missing in the config or checkpoint.
         """
-        thread_id = config.get(CONFIGURABLE, {}).get(THREAD_ID)
-        if not thread_id:
-            raise ValueError(f"'{THREAD_ID}' is required in config['{CONFIGURABLE}']")
-        checkpoint_id = checkpoint.get("id")
-        if not checkpoint_id:
-            raise ValueError("Checkpoint must have an 'id' field")
-
-        # Use checkpoint_id as the document ID to ensure uniqueness
-        doc_id = checkpoint_id
-
-        # Serialize checkpoint and metadata
-        checkpoint_data, checkpoint_encoded = self._serialize_field(checkpoint)
-        metadata_data, metadata_encoded = self._serialize_field(metadata)
-
-        doc = {
-            "id": doc_id,
-            THREAD_ID: thread_id,
-            CHECKPOINT_ID: checkpoint_id,
-            CHECKPOINT: checkpoint_data,
-            METADATA: metadata_data,
-            CHECKPOINT_ENCODED: checkpoint_encoded,
-            METADATA_ENCODED: metadata_encoded,
-        }
-        parent_checkpoint_id = config.get(CONFIGURABLE, {}).get(CHECKPOINT_ID)
-        if parent_checkpoint_id:
-            doc[PARENT_CHECKPOINT_ID] = parent_checkpoint_id
+        doc = self._checkpoint_doc(config, checkpoint, metadata)
 
-        self.upsert_item(doc)
+        # Checkpoint and head pointer share the thread's partition, so this is one transactional batch
+        _, head_response = self.upsert_items([doc, self._head_doc(doc)])
+        self._cache_put(doc, checkpoint, metadata, head_response)
 
         return {
             CONFIGURABLE: {
-                THREAD_ID: thread_id,
-                CHECKPOINT_ID: checkpoint_id,
+                THREAD_ID: doc[THREAD_ID],
+                CHECKPOINT_ID: doc[CHECKPOINT_ID],
             }
         }
 
@@ -390,7 +676,7 @@ class BaseCosmosDBSaver(ABC, BaseCheckpointSaver):
             doc_id = f"{checkpoint_id}_{task_id}_{idx}"
 
             # Use the helper method to serialize the value
-            value_data, value_encoded = self._serialize_field(value)
+            value_data, value_codec, _ = self._serialize_field(value)
 
             doc = {
                 "id": doc_id,
@@ -401,7 +687,7 @@ class BaseCosmosDBSaver(ABC, BaseCheckpointSaver):
                 "channel": channel,
                 "type": type(value).__name__,
                 "value": value_data,
-                "value_encoded": value_encoded,
+                VALUE_CODEC: value_codec,
             }
             docs.append(doc)
 
@@ -422,11 +708,17 @@ class CosmosDBSaver(BaseCosmosDBSaver, AbstractContextManager):
         database_name: str,
         container_name: str,
         serde: Optional[SerializerProtocol] = None,
+        cache_max_bytes: Optional[int] = None,
+        cache_ttl: Optional[float] = 300,
+        codec: Optional[CheckpointCodec] = None,
     ) -> None:
         super().__init__(
             database_name=database_name,
             container_name=container_name,
-            serde=serde
+            serde=serde,
+            cache_max_bytes=cache_max_bytes,
+            cache_ttl=cache_ttl,
+            codec=codec,
         )
         self.client = CosmosClient(endpoint, credential=key)
         self.lock = threading.Lock()
@@ -487,7 +779,7 @@ class CosmosDBSaver(BaseCosmosDBSaver, AbstractContextManager):
         # this is where you'd close them. Placeholder for future resource cleanup.
         pass
 
-    def upsert_item(self, doc: Dict[str, Any]) -> None:
+    def upsert_item(self, doc: Dict[str, Any]) -> Dict[str, Any]:
         """Upsert an item into the database with retry logic."""
         if not self._initialized:
             raise RuntimeError("CosmosDBSaver not initialized. Call setup() first.")
@@ -496,8 +788,7 @@ class CosmosDBSaver(BaseCosmosDBSaver, AbstractContextManager):
         for attempt in range(max_retries):
             try:
                 with self.lock:
-                    self.container.upsert_item(doc)
-                break
+                    return self.container.upsert_item(doc)
             except exceptions.CosmosHttpResponseError as e:
                 if attempt < max_retries - 1 and e.status_code in (429, 503):
                     wait_time = 2 ** attempt
@@ -508,42 +799,95 @@ class CosmosDBSaver(BaseCosmosDBSaver, AbstractContextManager):
                     raise
 
                     
-    def upsert_items(self, docs: List[Dict[str, Any]]) -> None:
-        """Upsert multiple items individually."""
+    def upsert_items(self, docs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Upsert multiple items with one transactional batch per partition key (up to 100 operations each),
+        so a step's writes cost a single round trip. Falls back to individual upserts if the batch fails.
+        """
         if not self._initialized:
             raise RuntimeError("CosmosDBSaver not initialized. Call setup() first.")
 
+        results = [None] * len(docs)
+        for partition_key, positions in self._batch_groups(docs):
+            batch_docs = [docs[i] for i in positions]
+            if len(batch_docs) == 1 or not hasattr(self.container, "execute_item_batch"):
+                for position, doc in zip(positions, batch_docs):
+                    results[position] = self.upsert_item(doc)
+                continue
+            try:
+                responses = self._execute_batch(partition_key, batch_docs)
+            except (CosmosBatchOperationError, _BatchFallback) as e:
+                logger.warning(f"Transactional batch failed, upserting {len(batch_docs)} items individually: {e}")
+                responses = [self.upsert_item(doc) for doc in batch_docs]
+            for position, response in zip(positions, responses):
+                results[position] = response
+        return results
+
+    def _execute_batch(self, partition_key: str, docs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Run one transactional batch of upserts with retry logic."""
+        operations = [("upsert", (doc,)) for doc in docs]
         max_retries = 3
-        for doc in docs:
-            for attempt in range(max_retries):
-                try:
-                    with self.lock:
-                        self.container.upsert_item(doc)
-                    break  # Exit the retry loop on success
-                except exceptions.CosmosHttpResponseError as e:
-                    if attempt < max_retries - 1 and e.status_code in (429, 503):
-                        wait_time = 2 ** attempt
-                        logger.warning(f"Retrying upsert_item in {wait_time} seconds due to error: {e}")
-                        time.sleep(wait_time)
-                    else:
-                        logger.error(f"Error upserting item after {max_retries} attempts: {e}")
-                        raise
+        for attempt in range(max_retries):
+            try:
+                with self.lock:
+                    return self.container.execute_item_batch(batch_operations=operations, partition_key=partition_key)
+            except exceptions.CosmosHttpResponseError as e:
+                if e.status_code in self.BATCH_FALLBACK_STATUSES:
+                    raise _BatchFallback(str(e)) from e
+                if attempt < max_retries - 1 and e.status_code in (429, 503):
+                    wait_time = 2 ** attempt
+                    logger.warning(f"Retrying execute_item_batch in {wait_time} seconds due to error: {e}")
+                    time.sleep(wait_time)
+                else:
+                    logger.error(f"Error executing batch after {max_retries} attempts: {e}")
+                    raise
                     
                     
+    def read_item(self, item_id: str, partition_key: str, etag: Optional[str] = None) -> Any:
+        """
+        Point-read an item with retry logic. Returns None if it doesn't exist.
+        With an etag the read is conditional and returns NOT_MODIFIED if the item still has that etag.
+        """
+        if not self._initialized:
+            raise RuntimeError("CosmosDBSaver not initialized. Call setup() first.")
+
+        options = {"etag": etag, "match_condition": MatchConditions.IfModified} if etag else {}
+        max_retries = 3
+        for attempt in range(max_retries):
+            try:
+                with self.lock:
+                    item = self.container.read_item(item=item_id, partition_key=partition_key, **options)
+                # A 304 on a conditional read comes back without a body
+                return item if item or not etag else NOT_MODIFIED
+            except exceptions.CosmosResourceNotFoundError:
+                return None
+            except exceptions.CosmosHttpResponseError as e:
+                if etag and e.status_code == 304:
+                    return NOT_MODIFIED
+                if attempt < max_retries - 1 and e.status_code in (429, 503):
+                    wait_time = 2 ** attempt
+                    logger.warning(f"Retrying read_item in {wait_time} seconds due to error: {e}")
+                    time.sleep(wait_time)
+                else:
+                    logger.error(f"Error reading item after {max_retries} attempts: {e}")
+                    raise
+
     def query_items(
         self,
         query: str,
         parameters: Optional[List[Dict[str, Any]]] = None,
+        partition_key: Optional[str] = None,
     ) -> Iterator[Dict[str, Any]]:
-        """Query items from the database with retry logic."""
+        """Query items from the database with retry logic. Cross-partition only when no partition_key is given."""
         max_retries = 3
+        partition_options = {"partition_key": partition_key} if partition_key is not None else {"enable_cross_partition_query": True}
         for attempt in range(max_retries):
             try:
                 with self.lock:
                     items = self.container.query_items(
                         query=query,
                         parameters=parameters,
-                        enable_cross_partition_query=True
+                        **partition_options
                     )
                 return items
             except exceptions.CosmosHttpResponseError as e:
@@ -558,6 +902,10 @@ class CosmosDBSaver(BaseCosmosDBSaver, AbstractContextManager):
 class AsyncCosmosDBSaver(BaseCosmosDBSaver, AbstractAsyncContextManager):
     """
     An asynchronous checkpoint saver that stores checkpoints in an Azure Cosmos DB database.
+
+    Cosmos I/O runs concurrently (the SDK client is safe to share). Use max_concurrency to bound the
+    number of in-flight requests (RU protection), and ordered_threads to run the operations of each
+    thread_id one at a time while different threads still proceed in parallel.
     """
 
     def __init__(
@@ -568,14 +916,25 @@ class AsyncCosmosDBSaver(BaseCosmosDBSaver, AbstractAsyncContextManager):
         database_name: str,
         container_name: str,
         serde: Optional[SerializerProtocol] = None,
+        max_concurrency: Optional[int] = None,
+        ordered_threads: bool = False,
+        cache_max_bytes: Optional[int] = None,
+        cache_ttl: Optional[float] = 300,
+        codec: Optional[CheckpointCodec] = None,
     ) -> None:
         super().__init__(
             database_name=database_name,
             container_name=container_name,
-            serde=serde
+            serde=serde,
+            cache_max_bytes=cache_max_bytes,
+            cache_ttl=cache_ttl,
+            codec=codec,
         )
         self.client = AsyncCosmosClient(endpoint, credential=key)
-        self.lock = asyncio.Lock()
+        self.semaphore = asyncio.Semaphore(max_concurrency) if max_concurrency else None
+        self.ordered_threads = ordered_threads
+        # Per-thread locks disappear once no operation on the thread holds them
+        self._thread_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
         self._initialized = False  # Track if setup was run
         
     async def __aenter__(self) -> Self:
@@ -630,7 +989,20 @@ class AsyncCosmosDBSaver(BaseCosmosDBSaver, AbstractAsyncContextManager):
         await self.client.close()
 
 
-    async def upsert_item(self, doc: Dict[str, Any]) -> None:
+    @asynccontextmanager
+    async def _guard(self, thread_id: Optional[str] = None):
+        """Applies the per-thread ordering (if enabled) and the concurrency bound around one Cosmos call."""
+        async with AsyncExitStack() as stack:
+            if self.ordered_threads and thread_id is not None:
+                lock = self._thread_locks.get(thread_id)
+                if lock is None:
+                    lock = self._thread_locks[thread_id] = asyncio.Lock()
+                await stack.enter_async_context(lock)
+            if self.semaphore is not None:
+                await stack.enter_async_context(self.semaphore)
+            yield
+
+    async def upsert_item(self, doc: Dict[str, Any]) -> Dict[str, Any]:
         """Upsert an item into the database asynchronously with retry logic."""
         if not self._initialized:
             raise RuntimeError("AsyncCosmosDBSaver not initialized. Call setup() first.")
@@ -638,9 +1010,8 @@ class AsyncCosmosDBSaver(BaseCosmosDBSaver, AbstractAsyncContextManager):
         max_retries = 3
         for attempt in range(max_retries):
             try:
-                async with self.lock:
-                    await self.container.upsert_item(doc)
-                break
+                async with self._guard(doc.get(THREAD_ID)):
+                    return await self.container.upsert_item(doc)
             except exceptions.CosmosHttpResponseError as e:
                 if attempt < max_retries - 1 and e.status_code in (429, 503):
                     wait_time = 2 ** attempt
@@ -650,33 +1021,82 @@ class AsyncCosmosDBSaver(BaseCosmosDBSaver, AbstractAsyncContextManager):
                     logger.error(f"Error upserting item after {max_retries} attempts: {e}")
                     raise
 
-    async def upsert_items(self, docs: List[Dict[str, Any]]) -> None:
-            """Asynchronously upsert multiple items individually."""
-            if not self._initialized:
-                raise RuntimeError("AsyncCosmosDBSaver not initialized. Call setup() first.")
+    async def upsert_items(self, docs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Asynchronously upsert multiple items with one transactional batch per partition key (up to 100
+        operations each). Falls back to individual upserts if the batch fails.
+        """
+        if not self._initialized:
+            raise RuntimeError("AsyncCosmosDBSaver not initialized. Call setup() first.")
 
-            max_retries = 3
-            for doc in docs:
-                for attempt in range(max_retries):
-                    try:
-                        async with self.lock:
-                            await self.container.upsert_item(doc)
-                        break  # Exit the retry loop on success
-                    except exceptions.CosmosHttpResponseError as e:
-                        if attempt < max_retries - 1 and e.status_code in (429, 503):
-                            wait_time = 2 ** attempt
-                            logger.warning(f"Retrying upsert_item in {wait_time} seconds due to error: {e}")
-                            await asyncio.sleep(wait_time)
-                        else:
-                            logger.error(f"Error upserting item after {max_retries} attempts: {e}")
-                            raise
+        results = [None] * len(docs)
+        for partition_key, positions in self._batch_groups(docs):
+            batch_docs = [docs[i] for i in positions]
+            if len(batch_docs) == 1 or not hasattr(self.container, "execute_item_batch"):
+                for position, doc in zip(positions, batch_docs):
+                    results[position] = await self.upsert_item(doc)
+                continue
+            try:
+                responses = await self._execute_batch(partition_key, batch_docs)
+            except (CosmosBatchOperationError, _BatchFallback) as e:
+                logger.warning(f"Transactional batch failed, upserting {len(batch_docs)} items individually: {e}")
+                responses = [await self.upsert_item(doc) for doc in batch_docs]
+            for position, response in zip(positions, responses):
+                results[position] = response
+        return results
+
+    async def _execute_batch(self, partition_key: str, docs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Run one transactional batch of upserts asynchronously with retry logic."""
+        operations = [("upsert", (doc,)) for doc in docs]
+        max_retries = 3
+        for attempt in range(max_retries):
+            try:
+                async with self._guard(partition_key):
+                    return await self.container.execute_item_batch(batch_operations=operations, partition_key=partition_key)
+            except exceptions.CosmosHttpResponseError as e:
+                if e.status_code in self.BATCH_FALLBACK_STATUSES:
+                    raise _BatchFallback(str(e)) from e
+                if attempt < max_retries - 1 and e.status_code in (429, 503):
+                    wait_time = 2 ** attempt
+                    logger.warning(f"Retrying execute_item_batch in {wait_time} seconds due to error: {e}")
+                    await asyncio.sleep(wait_time)
+                else:
+                    logger.error(f"Error executing batch after {max_retries} attempts: {e}")
+                    raise
+
+    async def read_item(self, item_id: str, partition_key: str, etag: Optional[str] = None) -> Any:
+        """Point-read an item asynchronously with retry logic (conditional if an etag is given, see CosmosDBSaver.read_item)."""
+        if not self._initialized:
+            raise RuntimeError("AsyncCosmosDBSaver not initialized. Call setup() first.")
+
+        options = {"etag": etag, "match_condition": MatchConditions.IfModified} if etag else {}
+        max_retries = 3
+        for attempt in range(max_retries):
+            try:
+                async with self._guard(partition_key):
+                    item = await self.container.read_item(item=item_id, partition_key=partition_key, **options)
+                # A 304 on a conditional read comes back without a body
+                return item if item or not etag else NOT_MODIFIED
+            except exceptions.CosmosResourceNotFoundError:
+                return None
+            except exceptions.CosmosHttpResponseError as e:
+                if etag and e.status_code == 304:
+                    return NOT_MODIFIED
+                if attempt < max_retries - 1 and e.status_code in (429, 503):
+                    wait_time = 2 ** attempt
+                    logger.warning(f"Retrying read_item in {wait_time} seconds due to error: {e}")
+                    await asyncio.sleep(wait_time)
+                else:
+                    logger.error(f"Error reading item after {max_retries} attempts: {e}")
+                    raise
 
     def query_items(
         self,
         query: str,
         parameters: Optional[List[Dict[str, Any]]] = None,
+        partition_key: Optional[str] = None,
     ) -> AsyncIterator[Dict[str, Any]]:
-        """Query items from the database asynchronously with retry logic."""
+        """Query items from the database asynchronously with retry logic (within one partition if partition_key is given)."""
         if not self._initialized:
             raise RuntimeError("AsyncCosmosDBSaver not initialized. Call setup() first.")
 
@@ -684,12 +1104,19 @@ class AsyncCosmosDBSaver(BaseCosmosDBSaver, AbstractAsyncContextManager):
             max_retries = 3
             for attempt in range(max_retries):
                 try:
-                    async with self.lock:
-                        items = self.container.query_items(
-                            query=query,
-                            parameters=parameters,
-                        )
-                    async for item in items:
+                    partition_options = {"partition_key": partition_key} if partition_key is not None else {}
+                    items = self.container.query_items(
+                        query=query,
+                        parameters=parameters,
+                        **partition_options
+                    ).__aiter__()
+                    while True:
+                        # Only hold the concurrency slot while fetching, never while the caller consumes an item
+                        async with self._guard():
+                            try:
+                                item = await items.__anext__()
+                            except StopAsyncIteration:
+                                break
                         yield item
                     break
                 except exceptions.CosmosHttpResponseError as e:
@@ -708,57 +1135,33 @@ class AsyncCosmosDBSaver(BaseCosmosDBSaver, AbstractAsyncContextManager):
         if not self._initialized:
             raise RuntimeError("AsyncCosmosDBSaver not initialized. Call setup() first.")
         
-        thread_id = config.get(CONFIGURABLE, {}).get(THREAD_ID)
-        if not thread_id:
-            raise ValueError(f"'{THREAD_ID}' is required in config['{CONFIGURABLE}']")
-        checkpoint_id = get_checkpoint_id(config)
-        parameters = [{"name": "@thread_id", "value": thread_id}]
+        thread_id, checkpoint_id = self._config_ids(config)
+        return await self._aread_checkpoint(thread_id, checkpoint_id)
+
+    async def _aread_checkpoint(self, thread_id: str, checkpoint_id: Optional[str]) -> Optional[CheckpointTuple]:
+        """Async version of _read_checkpoint."""
         if checkpoint_id:
-            query = (
-                "SELECT * FROM c WHERE c.thread_id = @thread_id AND IS_DEFINED(c.checkpoint) "
-                "AND c.checkpoint_id = @checkpoint_id"
-            )
-            parameters.append({"name": "@checkpoint_id", "value": checkpoint_id})
-        else:
-            query = (
-                "SELECT * FROM c WHERE c.thread_id = @thread_id AND IS_DEFINED(c.checkpoint) "
-                "ORDER BY c.checkpoint_id DESC OFFSET 0 LIMIT 1"
-            )
-
-        items_iterable = self.query_items(query=query, parameters=parameters)
-
-        results = []
-        async for item in items_iterable:
-            results.append(item)
-
-        if results:
-            doc = results[0]
-            checkpoint = self._deserialize_field(doc, CHECKPOINT, CHECKPOINT_ENCODED)
-            metadata = self._deserialize_field(doc, METADATA, METADATA_ENCODED)
-            parent_checkpoint_id = doc.get(PARENT_CHECKPOINT_ID)
-            parent_config = (
-                {
-                    CONFIGURABLE: {
-                        THREAD_ID: doc[THREAD_ID],
-                        CHECKPOINT_ID: parent_checkpoint_id,
-                    }
-                }
-                if parent_checkpoint_id
-                else None
-            )
-            return CheckpointTuple(
-                {
-                    CONFIGURABLE: {
-                        THREAD_ID: doc[THREAD_ID],
-                        CHECKPOINT_ID: doc[CHECKPOINT_ID],
-                    }
-                },
-                checkpoint,
-                metadata,
-                parent_config,
-            )
-        else:
-            return None
+            if self.cache is not None:
+                cached = self.cache.get(thread_id, checkpoint_id)
+                if cached is not None:
+                    return cached
+            doc = await self.read_item(checkpoint_id, thread_id)
+            return self._cache_doc(doc if doc is not None and CHECKPOINT in doc else None)
+
+        latest = self.cache.latest(thread_id) if self.cache is not None else None
+        head = await self.read_item(thread_id, thread_id, etag=latest[1] if latest else None)
+        checkpoint_id, head_etag = self._head_target(latest, head)
+        if checkpoint_id:
+            checkpoint_tuple = await self._aread_checkpoint(thread_id, checkpoint_id)
+            if checkpoint_tuple is not None:
+                if self.cache is not None:
+                    self.cache.set_latest(thread_id, checkpoint_id, head_etag)
+                return checkpoint_tuple
+        # Threads written before head pointers existed: single-partition query
+        parameters = [{"name": "@thread_id", "value": thread_id}]
+        async for doc in self.query_items(query=LATEST_CHECKPOINT_QUERY, parameters=parameters, partition_key=thread_id):
+            return self._cache_doc(doc)
+        return None
 
 
     async def alist(
@@ -775,6 +1178,7 @@ class AsyncCosmosDBSaver(BaseCosmosDBSaver, AbstractAsyncContextManager):
         
         parameters = []
         conditions = []
+        thread_id = None
         if config is not None:
             thread_id = config.get(CONFIGURABLE, {}).get(THREAD_ID)
             if not thread_id:
@@ -801,33 +1205,10 @@ class AsyncCosmosDBSaver(BaseCosmosDBSaver, AbstractAsyncContextManager):
 
         query = f"SELECT * FROM c WHERE {where_clause} {order_clause} {limit_clause}"
 
-        items_iterable = self.query_items(query=query, parameters=parameters)
+        items_iterable = self.query_items(query=query, parameters=parameters, partition_key=thread_id)
 
         async for doc in items_iterable:
-            checkpoint = self._deserialize_field(doc, CHECKPOINT, CHECKPOINT_ENCODED)
-            metadata = self._deserialize_field(doc, METADATA, METADATA_ENCODED)
-            parent_checkpoint_id = doc.get(PARENT_CHECKPOINT_ID)
-            parent_config = (
-                {
-                    CONFIGURABLE: {
-                        THREAD_ID: doc[THREAD_ID],
-                        CHECKPOINT_ID: parent_checkpoint_id,
-                    }
-                }
-                if parent_checkpoint_id
-                else None
-            )
-            yield CheckpointTuple(
-                {
-                    CONFIGURABLE: {
-                        THREAD_ID: doc[THREAD_ID],
-                        CHECKPOINT_ID: doc[CHECKPOINT_ID],
-                    }
-                },
-                checkpoint,
-                metadata,
-                parent_config,
-            )
+            yield self._doc_to_tuple(doc)
 
     async def aput(
         self,
@@ -840,38 +1221,16 @@ class AsyncCosmosDBSaver(BaseCosmosDBSaver, AbstractAsyncContextManager):
         if not self._initialized:
             raise RuntimeError("AsyncCosmosDBSaver not initialized. Call setup() first.")
         
-        thread_id = config.get(CONFIGURABLE, {}).get(THREAD_ID)
-        if not thread_id:
-            raise ValueError(f"'{THREAD_ID}' is required in config['{CONFIGURABLE}']")
-        checkpoint_id = checkpoint.get("id")
-        if not checkpoint_id:
-            raise ValueError("Checkpoint must have an 'id' field")
-
-        doc_id = checkpoint_id
-
-        # Serialize checkpoint and metadata
-        checkpoint_data, checkpoint_encoded = self._serialize_field(checkpoint)
-        metadata_data, metadata_encoded = self._serialize_field(metadata)
+        doc = self._checkpoint_doc(config, checkpoint, metadata)
 
-        doc = {
-            "id": doc_id,
-            THREAD_ID: thread_id,
-            CHECKPOINT_ID: checkpoint_id,
-            CHECKPOINT: checkpoint_data,
-            METADATA: metadata_data,
-            CHECKPOINT_ENCODED: checkpoint_encoded,
-            METADATA_ENCODED: metadata_encoded,
-        }
-        parent_checkpoint_id = config.get(CONFIGURABLE, {}).get(CHECKPOINT_ID)
-        if parent_checkpoint_id:
-            doc[PARENT_CHECKPOINT_ID] = parent_checkpoint_id
-
-        await self.upsert_item(doc)
+        # Checkpoint and head pointer share the thread's partition, so this is one transactional batch
+        _, head_response = await self.upsert_items([doc, self._head_doc(doc)])
+        self._cache_put(doc, checkpoint, metadata, head_response)
 
         return {
             CONFIGURABLE: {
-                THREAD_ID: thread_id,
-                CHECKPOINT_ID: checkpoint_id,
+                THREAD_ID: doc[THREAD_ID],
+                CHECKPOINT_ID: doc[CHECKPOINT_ID],
             }
         }
 
@@ -896,7 +1255,7 @@ class AsyncCosmosDBSaver(BaseCosmosDBSaver, AbstractAsyncContextManager):
             doc_id = f"{checkpoint_id}_{task_id}_{idx}"
 
             # Use the helper method to serialize the value
-            value_data, value_encoded = self._serialize_field(value)
+            value_data, value_codec, _ = self._serialize_field(value)
 
             doc = {
                 "id": doc_id,
@@ -907,7 +1266,7 @@ class AsyncCosmosDBSaver(BaseCosmosDBSaver, AbstractAsyncContextManager):
                 "channel": channel,
                 "type": type(value).__name__,
                 "value": value_data,
-                "value_encoded": value_encoded,
+                VALUE_CODEC: value_codec,
             }
             docs.append(doc)
 
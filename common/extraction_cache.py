@@ -0,0 +1,162 @@
+# extraction_cache.py
+# -----------------------------------------------------------------------------
+# On-disk cache for PDF extraction results (the page_map of utils.parse_pdf).
+# Entries are keyed by the SHA-256 of the file's content plus the extractor and
+# model name, so unchanged documents are never parsed (or billed) twice.
+# Values are zlib-compressed msgpack (JSON when ormsgpack isn't installed) and
+# the least recently used entries are evicted once the cache exceeds max_bytes.
+# -----------------------------------------------------------------------------
+
+import os
+import json
+import zlib
+import hashlib
+import threading
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    import ormsgpack
+except ImportError:
+    ormsgpack = None
+
+logger = logging.getLogger(__name__)
+
+_MSGPACK = b"m"
+_JSON = b"j"
+
+
+def hash_file(file, chunk_size: int = 1 << 20) -> str:
+    """SHA-256 of a file's content. Accepts a path or a seekable file-like object (left at its original position)."""
+    digest = hashlib.sha256()
+    if isinstance(file, str):
+        with open(file, "rb") as stream:
+            for chunk in iter(lambda: stream.read(chunk_size), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+    if hasattr(file, "getvalue"):
+        digest.update(file.getvalue())
+        return digest.hexdigest()
+    # Hash the whole file wherever the handle currently is
+    position = file.tell()
+    file.seek(0)
+    try:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            digest.update(chunk)
+    finally:
+        file.seek(position)
+    return digest.hexdigest()
+
+
+class PdfExtractionCache:
+    """
+    Content-addressed cache of page_maps stored as one compressed file per entry.
+    Reads refresh the entry's mtime, which drives the size-based LRU eviction.
+    """
+
+    def __init__(self, cache_dir: str = ".cache/pdf_extraction", max_bytes: int = 1 << 30, compression_level: int = 6):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.compression_level = compression_level
+        os.makedirs(cache_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._bytes = sum(size for _, _, size in self._entries())
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(content_hash: str, extractor: str, model: Optional[str] = None) -> str:
+        return hashlib.sha256(f"{content_hash}|{extractor}|{model or ''}".encode("utf-8")).hexdigest()
+
+    def key_for(self, file, extractor: str, model: Optional[str] = None) -> str:
+        return self.make_key(hash_file(file), extractor, model)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key + ".bin")
+
+    def _entries(self) -> List[Tuple[float, str, int]]:
+        """Returns (mtime, path, size) for every entry in the cache directory"""
+        entries = []
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                if entry.name.endswith(".bin"):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, entry.path, stat.st_size))
+        return entries
+
+    def _encode(self, page_map: List[Tuple[int, int, str]]) -> bytes:
+        if ormsgpack is not None:
+            return _MSGPACK + zlib.compress(ormsgpack.packb(page_map), self.compression_level)
+        return _JSON + zlib.compress(json.dumps(page_map).encode("utf-8"), self.compression_level)
+
+    @staticmethod
+    def _decode(data: bytes) -> List[Tuple[int, int, str]]:
+        fmt, payload = data[:1], zlib.decompress(data[1:])
+        if fmt == _MSGPACK:
+            if ormsgpack is None:
+                raise ValueError("Cache entry was written with msgpack but ormsgpack is not installed")
+            page_map = ormsgpack.unpackb(payload)
+        else:
+            page_map = json.loads(payload)
+        return [tuple(page) for page in page_map]
+
+    def get(self, key: str) -> Optional[List[Tuple[int, int, str]]]:
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                page_map = self._decode(f.read())
+            os.utime(path)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except (ValueError, zlib.error) as e:
+            logger.warning(f"Discarding unreadable extraction cache entry {key}: {e}")
+            self.misses += 1
+            return None
+        self.hits += 1
+        return page_map
+
+    def set(self, key: str, page_map: List[Tuple[int, int, str]]) -> None:
+        data = self._encode(page_map)
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        with self._lock:
+            previous = os.path.getsize(path) if os.path.exists(path) else 0
+            # Atomic rename so concurrent readers never see a partially written entry
+            os.replace(tmp_path, path)
+            self._bytes += len(data) - previous
+            if self._bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self) -> None:
+        """Deletes the least recently used entries until the cache is back under max_bytes"""
+        entries = sorted(self._entries())
+        self._bytes = sum(size for _, _, size in entries)
+        for _, path, size in entries:
+            if self._bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self._bytes -= size
+            self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            for _, path, _ in self._entries():
+                os.remove(path)
+            self._bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._entries())
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self), "bytes": self._bytes, "max_bytes": self.max_bytes,
+                "evictions": self.evictions}
@@ -31,6 +31,7 @@ from common.utils import (
     create_apisearch_agent,
     reduce_openapi_spec
 )
+from common.search_cache import InMemorySearchCache
 from common.prompts import (
     CUSTOM_CHATBOT_PREFIX,
     DOCSEARCH_PROMPT_TEXT,
@@ -162,7 +163,9 @@ def build_async_workflow(csv_file_path: str ="all-states-history.csv",
         k=20,
         reranker_th=1.5,
         prompt=CUSTOM_CHATBOT_PREFIX + DOCSEARCH_PROMPT_TEXT,
-        sas_token=os.environ.get("BLOB_SAS_TOKEN", "")
+        sas_token=os.environ.get("BLOB_SAS_TOKEN", ""),
+        # The supervisor often routes here several times per conversation, and questions repeat across users
+        cache=InMemorySearchCache(max_entries=1024, ttl=int(os.environ.get("SEARCH_CACHE_TTL", 300)))
     )
 
     csvsearch_agent = create_csvsearch_agent(
@@ -0,0 +1,589 @@
+# ingestion.py
+# -----------------------------------------------------------------------------
+# Helpers to (re-)index parsed documents into Azure AI Search.
+#   - IndexManifest: local JSON record of what is in the index (per-page hashes)
+#   - IncrementalIndexer: embeds and uploads only new/changed pages and deletes
+#     the pages that disappeared, using the deterministic page ids of 04-Complex-Docs
+#   - TokenChunker: token-budgeted chunks with overlap that never split a <table>
+#   - IngestionPipeline: parse -> chunk -> embed -> upload stages connected by
+#     bounded asyncio queues, with adaptive batch sizes on 429s
+# -----------------------------------------------------------------------------
+
+import os
+import json
+import time
+import re
+import bisect
+import itertools
+import asyncio
+import uuid
+import hashlib
+import logging
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+try:
+    from .utils import (AzureSearchClient, ThrottledError, get_default_search_client, parse_pdf, num_tokens_from_strings,
+                       get_token_encoder)
+except ImportError:
+    from utils import (AzureSearchClient, ThrottledError, get_default_search_client, parse_pdf, num_tokens_from_strings,
+                       get_token_encoder)
+
+logger = logging.getLogger(__name__)
+
+
+def page_doc_id(name: str, page_num: int) -> str:
+    """Deterministic document id of a page (page_num is 1-based), as used by the notebooks"""
+    return str(uuid.uuid5(uuid.NAMESPACE_DNS, f"{name}{page_num}"))
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class IndexManifest:
+    """
+    Local record of the documents uploaded to one index: doc id -> {"name", "page_num", "hash"}.
+    Saved atomically as JSON so an interrupted run never leaves a corrupt manifest behind.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+
+    def save(self) -> None:
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.entries, f)
+        os.replace(tmp_path, self.path)
+
+    def ids_for(self, name: str) -> List[str]:
+        return [doc_id for doc_id, entry in self.entries.items() if entry["name"] == name]
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self.entries
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+
+class IncrementalIndexer:
+    """
+    Re-indexes a corpus of parsed documents ({name: page_map}) while only paying for what changed.
+
+    Every page is hashed and compared with the manifest: new or modified pages are embedded and uploaded,
+    pages (or whole documents, with prune=True) that are no longer in the corpus get a "delete" action,
+    and unchanged pages are skipped. The manifest is updated per batch from the per-document status
+    returned by the service, so a failed or interrupted run is simply resumed by the next one.
+    """
+
+    def __init__(self, index_name: str, embedder: Any, manifest_path: str, base_url: Optional[str] = None,
+                 client: Optional[AzureSearchClient] = None, batch_size: int = 75, verbose: bool = False):
+        self.index_name = index_name
+        self.embedder = embedder
+        self.manifest = IndexManifest(manifest_path)
+        self.base_url = base_url
+        self.client = client
+        self.batch_size = batch_size
+        self.verbose = verbose
+
+    def _location(self, name: str) -> str:
+        return (self.base_url if self.base_url is not None else os.environ['BASE_CONTAINER_URL']) + name
+
+    def plan(self, pages_map: Dict[str, List[Tuple[int, int, str]]], prune: bool = False) -> Tuple[List[Tuple[str, Tuple[int, int, str], str]], List[str]]:
+        """Returns (pages to upload as (name, page, hash), doc ids to delete) without touching the index"""
+        to_upload = []
+        seen = set()
+        for name, page_map in pages_map.items():
+            for page in page_map:
+                doc_id = page_doc_id(name, page[0] + 1)
+                seen.add(doc_id)
+                page_hash = content_hash(page[2])
+                entry = self.manifest.entries.get(doc_id)
+                if entry is None or entry["hash"] != page_hash:
+                    to_upload.append((name, page, page_hash))
+        names = set(pages_map)
+        to_delete = [doc_id for doc_id, entry in self.manifest.entries.items()
+                     if doc_id not in seen and (prune or entry["name"] in names)]
+        return to_upload, to_delete
+
+    def _page_action(self, name: str, page: Tuple[int, int, str], vector: List[float]) -> dict:
+        page_num = page[0] + 1
+        return {
+            "@search.action": "upload",
+            "id": page_doc_id(name, page_num),
+            "title": f"{name}_page_{str(page_num)}",
+            "chunk": page[2],
+            "chunkVector": vector,
+            "name": name,
+            "location": self._location(name),
+            "page_num": page_num
+        }
+
+    def _send(self, actions: List[dict]) -> List[str]:
+        """Sends a batch and returns the keys the service accepted"""
+        client = self.client or get_default_search_client()
+        response = client.index_documents(self.index_name, actions)
+        if "value" not in response:
+            logger.error(f"Indexing batch failed: {response.get('error', response)}")
+            return []
+        failed = [r for r in response["value"] if not r.get("status")]
+        for r in failed:
+            logger.warning(f"Failed to index {r.get('key')}: {r.get('statusCode')} {r.get('errorMessage')}")
+        return [r["key"] for r in response["value"] if r.get("status")]
+
+    def sync(self, pages_map: Dict[str, List[Tuple[int, int, str]]], prune: bool = False) -> Dict[str, Any]:
+        """Brings the index in line with pages_map and returns counts and timings for the run"""
+        start = time.time()
+        to_upload, to_delete = self.plan(pages_map, prune=prune)
+        total_pages = sum(len(page_map) for page_map in pages_map.values())
+        if self.verbose:
+            print(f"{total_pages} pages: {len(to_upload)} new or changed, {total_pages - len(to_upload)} unchanged, {len(to_delete)} to delete")
+
+        uploaded, deleted, embedded = 0, 0, 0
+        for i in range(0, len(to_upload), self.batch_size):
+            batch = to_upload[i:i + self.batch_size]
+            vectors = self.embedder.embed_documents([page[2] for _, page, _ in batch])
+            embedded += len(batch)
+            accepted = set(self._send([self._page_action(name, page, vector) for (name, page, _), vector in zip(batch, vectors)]))
+            for name, page, page_hash in batch:
+                doc_id = page_doc_id(name, page[0] + 1)
+                if doc_id in accepted:
+                    self.manifest.entries[doc_id] = {"name": name, "page_num": page[0] + 1, "hash": page_hash}
+                    uploaded += 1
+            self.manifest.save()
+
+        for i in range(0, len(to_delete), self.batch_size):
+            batch = to_delete[i:i + self.batch_size]
+            for doc_id in self._send([{"@search.action": "delete", "id": doc_id} for doc_id in batch]):
+                self.manifest.entries.pop(doc_id, None)
+                deleted += 1
+            self.manifest.save()
+
+        stats = {"pages": total_pages, "unchanged": total_pages - len(to_upload), "embedded": embedded,
+                 "uploaded": uploaded, "deleted": deleted,
+                 "failed": len(to_upload) - uploaded + len(to_delete) - deleted,
+                 "seconds": time.time() - start}
+        if self.verbose: print(stats)
+        return stats
+
+    def sync_files(self, files: Dict[str, Any], prune: bool = False, **parse_kwargs: Any) -> Dict[str, Any]:
+        """Parses {name: path or stream} with parse_pdf (pass cache=... to skip unchanged files) and syncs the result"""
+        return self.sync({name: parse_pdf(file, **parse_kwargs) for name, file in files.items()}, prune=prune)
+
+
+def page_chunks(name: str, page_map: List[Tuple[int, int, str]], location: str = "") -> List[dict]:
+    """Default chunker: one index document per page, with the same fields as 04-Complex-Docs"""
+    chunks = []
+    for page_num, offset, page_text in page_map:
+        chunks.append({
+            "id": page_doc_id(name, page_num + 1),
+            "title": f"{name}_page_{str(page_num + 1)}",
+            "chunk": page_text,
+            "name": name,
+            "location": location,
+            "page_num": page_num + 1
+        })
+    return chunks
+
+
+_TABLE_RE = re.compile(r"<table\b.*?</table>", re.S | re.I)
+_SENTENCE_END_RE = re.compile(r"[.!?]\s+|\n+")
+
+
+class TokenChunker:
+    """
+    Splits a page_map into chunks of about target_tokens, with overlap_tokens of trailing text repeated
+    at the start of the next chunk. Small pages are merged and long pages split at sentence boundaries;
+    an HTML table (from table_to_html) is never split, so a table bigger than the target becomes its own chunk.
+    Each chunk keeps its provenance: first/last page and character offset/length in the document.
+    Tokens are counted with the cached encoder of utils.get_token_encoder.
+    """
+
+    def __init__(self, target_tokens: int = 512, overlap_tokens: int = 64, model: Optional[str] = None, provenance_fields: bool = False):
+        if overlap_tokens >= target_tokens:
+            raise ValueError("overlap_tokens must be smaller than target_tokens")
+        self.target_tokens = target_tokens
+        self.overlap_tokens = overlap_tokens
+        self.model = model
+        # Only add the page_end/offset/length fields to the index documents if the index defines them
+        self.provenance_fields = provenance_fields
+
+    def _page_units(self, text: str) -> List[Tuple[int, int, bool]]:
+        """Splits a page into contiguous (start, end, is_table) spans: whole tables and sentence-sized text"""
+        units = []
+        position = 0
+        for match in itertools.chain(_TABLE_RE.finditer(text), [None]):
+            end = match.start() if match else len(text)
+            if end > position:
+                boundaries = [m.end() for m in _SENTENCE_END_RE.finditer(text, position, end)]
+                starts = [position] + [b for b in boundaries if b < end]
+                ends = starts[1:] + [end]
+                units.extend((a, b, False) for a, b in zip(starts, ends) if b > a)
+            if match:
+                units.append((match.start(), match.end(), True))
+                position = match.end()
+        return units
+
+    def _split_long(self, text: str) -> List[Tuple[int, int]]:
+        """
+        Cuts an over-long run of text (no sentence breaks) into pieces of about target_tokens: at the last whitespace
+        before each token limit, or at the token limit itself when there is none (CJK text, URLs, base64 blobs).
+        """
+        encoder = get_token_encoder(self.model)
+        # Character offset at which each token starts
+        _, offsets = encoder.decode_with_offsets(encoder.encode_ordinary(text))
+        cuts = [0]
+        token = 0
+        while token + self.target_tokens < len(offsets):
+            limit = offsets[token + self.target_tokens]
+            # Prefer a word boundary in the second half of the window so pieces stay close to the target
+            window_start = (cuts[-1] + limit) // 2
+            space = max(text.rfind(" ", window_start, limit), text.rfind("\n", window_start, limit))
+            cut = space + 1 if space >= 0 else limit
+            cut = max(cut, cuts[-1] + 1)
+            cuts.append(cut)
+            token = bisect.bisect_left(offsets, cut)
+        cuts.append(len(text))
+        return [(a, b) for a, b in zip(cuts, cuts[1:]) if b > a]
+
+    def split(self, page_map: List[Tuple[int, int, str]]) -> List[dict]:
+        """Returns chunks as dicts with text, tokens, page_start, page_end (0-based), offset and length"""
+        units = []  # (page_num, doc_offset, text, is_table)
+        for page_num, offset, page_text in page_map:
+            for start, end, is_table in self._page_units(page_text):
+                units.append((page_num, offset + start, page_text[start:end], is_table))
+        if not units:
+            return []
+        counts = num_tokens_from_strings([unit[2] for unit in units], model=self.model)
+
+        sized = []
+        for unit, tokens in zip(units, counts):
+            page_num, offset, text, is_table = unit
+            if is_table or tokens <= self.target_tokens:
+                if tokens > self.target_tokens:
+                    logger.warning(f"Table on page {page_num + 1} has {tokens} tokens, over the {self.target_tokens} target; kept whole")
+                sized.append((unit, tokens))
+                continue
+            pieces = self._split_long(text)
+            piece_counts = num_tokens_from_strings([text[a:b] for a, b in pieces], model=self.model)
+            sized.extend(((page_num, offset + a, text[a:b], False), n) for (a, b), n in zip(pieces, piece_counts))
+
+        chunks = []
+        current, current_tokens, fresh = [], 0, 0
+
+        def emit():
+            text = "".join(unit[2] for unit, _ in current)
+            first, last = current[0][0], current[-1][0]
+            chunks.append({"text": text, "tokens": current_tokens, "page_start": first[0], "page_end": last[0],
+                           "offset": first[1], "length": last[1] + len(last[2]) - first[1]})
+
+        for unit, tokens in sized:
+            if current and current_tokens + tokens > self.target_tokens:
+                if fresh:
+                    emit()
+                    # Carry the trailing text (never a table) over as overlap
+                    overlap, overlap_tokens = [], 0
+                    for prev_unit, prev_tokens in reversed(current):
+                        if prev_unit[3] or overlap_tokens + prev_tokens > self.overlap_tokens:
+                            break
+                        overlap.insert(0, (prev_unit, prev_tokens))
+                        overlap_tokens += prev_tokens
+                    current, current_tokens = overlap, overlap_tokens
+                if current_tokens + tokens > self.target_tokens:
+                    current, current_tokens = [], 0
+                fresh = 0
+            current.append((unit, tokens))
+            current_tokens += tokens
+            fresh += 1
+        if fresh:
+            emit()
+        return chunks
+
+    def __call__(self, name: str, page_map: List[Tuple[int, int, str]], location: str = "") -> List[dict]:
+        """Chunker interface of IngestionPipeline: returns index documents for one parsed document"""
+        documents = []
+        for chunk in self.split(page_map):
+            first, last = chunk["page_start"] + 1, chunk["page_end"] + 1
+            document = {
+                "id": str(uuid.uuid5(uuid.NAMESPACE_DNS, f"{name}{first}_{chunk['offset']}")),
+                "title": f"{name}_page_{str(first)}" if first == last else f"{name}_pages_{first}-{last}",
+                "chunk": chunk["text"],
+                "name": name,
+                "location": location,
+                "page_num": first
+            }
+            if self.provenance_fields:
+                document.update(page_end=last, offset=chunk["offset"], length=chunk["length"])
+            documents.append(document)
+        return documents
+
+
+def throttle_delay(error: Exception) -> Optional[float]:
+    """Returns the suggested wait (0 if unknown) when the error is a 429/503 from OpenAI or Azure Search, else None"""
+    if isinstance(error, ThrottledError):
+        return error.retry_after or 0.0
+    response = getattr(error, "response", None)
+    status = getattr(error, "status_code", None) or getattr(response, "status_code", None)
+    if status not in (429, 503):
+        return None
+    retry_after = getattr(response, "headers", {}).get("retry-after")
+    try:
+        return float(retry_after) if retry_after else 0.0
+    except ValueError:
+        return 0.0
+
+
+class AdaptiveBatchSize:
+    """
+    AIMD batch sizing shared by the workers of one stage: halve the batch on a throttle,
+    grow it again by a quarter of the initial size after increase_after consecutive successes.
+    """
+
+    def __init__(self, initial: int, minimum: int = 1, maximum: Optional[int] = None, increase_after: int = 5,
+                 backoff: float = 1.0, max_backoff: float = 60.0):
+        self.initial = initial
+        self.size = initial
+        self.minimum = minimum
+        self.maximum = maximum or initial
+        self.increase_after = increase_after
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.throttles = 0
+        self._streak = 0
+        self._consecutive_throttles = 0
+
+    def on_success(self) -> None:
+        self._consecutive_throttles = 0
+        self._streak += 1
+        if self._streak >= self.increase_after and self.size < self.maximum:
+            self.size = min(self.maximum, self.size + max(1, self.initial // 4))
+            self._streak = 0
+
+    def on_throttle(self, attempted_size: int, retry_after: Optional[float] = None) -> float:
+        """Halves the throttled batch (once, however many workers hit the limit) and returns how long to wait"""
+        self.throttles += 1
+        self._streak = 0
+        self._consecutive_throttles += 1
+        # A batch bigger than the current size was sent before another worker already shrank it
+        if attempted_size <= self.size:
+            self.size = max(self.minimum, attempted_size // 2)
+        if retry_after:
+            return retry_after
+        return min(self.max_backoff, self.backoff * 2 ** (self._consecutive_throttles - 1))
+
+
+class _StageStats:
+    def __init__(self, name: str, workers: int):
+        self.name = name
+        self.workers = workers
+        self.items = 0
+        self.batches = 0
+        self.busy_seconds = 0.0
+        self.started = None
+        self.finished = None
+
+    def record(self, items: int, seconds: float) -> None:
+        self.items += items
+        self.batches += 1
+        self.busy_seconds += seconds
+
+    def as_dict(self) -> Dict[str, Any]:
+        elapsed = (self.finished or time.monotonic()) - self.started if self.started else 0.0
+        return {"workers": self.workers, "items": self.items, "batches": self.batches,
+                "busy_seconds": self.busy_seconds, "elapsed_seconds": elapsed,
+                "items_per_second": self.items / elapsed if elapsed else 0.0}
+
+
+_DONE = object()
+
+
+class IngestionPipeline:
+    """
+    Streams documents into an index through four concurrent stages:
+
+        parse (parse_pdf in threads) -> chunk -> embed (batched) -> upload (batched)
+
+    Stages are connected by bounded asyncio queues, so a slow stage applies backpressure upstream
+    instead of buffering the whole corpus, and embedding overlaps with uploading. Each stage has its own
+    number of workers. Embed and upload batch sizes shrink when the embedding or search endpoint
+    answers 429/503 and grow back once requests succeed again.
+
+    documents maps a name to a PDF (path or stream, parsed with parse_pdf(**parse_kwargs)) or to an
+    already parsed page_map. chunker(name, page_map, location) returns the index documents (without
+    the vector); it defaults to a TokenChunker, use page_chunks to keep one document per page.
+    """
+
+    def __init__(self, index_name: str, embedder: Any, client: Optional[AzureSearchClient] = None,
+                 chunker: Optional[Callable[..., List[dict]]] = None, base_url: Optional[str] = None,
+                 parse_workers: int = 2, chunk_workers: int = 1, embed_workers: int = 4, upload_workers: int = 4,
+                 embed_batch_size: int = 16, upload_batch_size: int = 100, queue_size: int = 1000,
+                 parse_kwargs: Optional[dict] = None, verbose: bool = False):
+        self.index_name = index_name
+        self.embedder = embedder
+        self.client = client
+        self.chunker = chunker or TokenChunker()
+        self.base_url = base_url
+        self.workers = {"parse": parse_workers, "chunk": chunk_workers, "embed": embed_workers, "upload": upload_workers}
+        self.embed_batch = AdaptiveBatchSize(embed_batch_size)
+        self.upload_batch = AdaptiveBatchSize(upload_batch_size)
+        self.queue_size = queue_size
+        self.parse_kwargs = parse_kwargs or {}
+        self.verbose = verbose
+        self.failed = []
+        self._stats = {}
+
+    def _location(self, name: str) -> str:
+        return (self.base_url if self.base_url is not None else os.environ.get('BASE_CONTAINER_URL', "")) + name
+
+    @staticmethod
+    def _take_batch(queue: asyncio.Queue, first: Any, size: int) -> Tuple[List[Any], bool]:
+        """Adds whatever is already queued (up to size items) to first; also reports whether the end marker was reached"""
+        if first is _DONE:
+            return [], True
+        batch = [first]
+        while len(batch) < size:
+            try:
+                item = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                break
+            if item is _DONE:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    async def _parse_worker(self, in_q: asyncio.Queue, out_q: asyncio.Queue) -> None:
+        stats = self._stats["parse"]
+        while (item := await in_q.get()) is not _DONE:
+            name, document = item
+            start = time.monotonic()
+            if isinstance(document, list):
+                page_map = document
+            else:
+                page_map = await asyncio.to_thread(parse_pdf, document, **self.parse_kwargs)
+            stats.record(len(page_map), time.monotonic() - start)
+            await out_q.put((name, page_map))
+
+    async def _chunk_worker(self, in_q: asyncio.Queue, out_q: asyncio.Queue) -> None:
+        stats = self._stats["chunk"]
+        while (item := await in_q.get()) is not _DONE:
+            name, page_map = item
+            start = time.monotonic()
+            # Off the event loop, so tokenization overlaps with the embed and upload I/O
+            chunks = await asyncio.to_thread(self.chunker, name, page_map, self._location(name))
+            stats.record(len(chunks), time.monotonic() - start)
+            for chunk in chunks:
+                await out_q.put(chunk)
+
+    async def _embed(self, texts: List[str]) -> List[List[float]]:
+        if hasattr(self.embedder, "aembed_documents"):
+            return await self.embedder.aembed_documents(texts)
+        return await asyncio.to_thread(self.embedder.embed_documents, texts)
+
+    async def _embed_worker(self, in_q: asyncio.Queue, out_q: asyncio.Queue) -> None:
+        stats = self._stats["embed"]
+        done = False
+        while not done:
+            batch, done = self._take_batch(in_q, await in_q.get(), self.embed_batch.size)
+            while batch:
+                size = self.embed_batch.size
+                part = batch[:size]
+                start = time.monotonic()
+                try:
+                    vectors = await self._embed([chunk["chunk"] for chunk in part])
+                except Exception as e:
+                    delay = throttle_delay(e)
+                    if delay is None:
+                        raise
+                    wait_time = self.embed_batch.on_throttle(len(part), delay)
+                    logger.warning(f"Embedding throttled, batch size now {self.embed_batch.size}, waiting {wait_time}s")
+                    await asyncio.sleep(wait_time)
+                    continue
+                self.embed_batch.on_success()
+                stats.record(len(part), time.monotonic() - start)
+                batch = batch[size:]
+                for chunk, vector in zip(part, vectors):
+                    await out_q.put({"@search.action": "upload", **chunk, "chunkVector": vector})
+
+    async def _upload_worker(self, in_q: asyncio.Queue, out_q: Optional[asyncio.Queue] = None) -> None:
+        stats = self._stats["upload"]
+        client = self.client or get_default_search_client()
+        done = False
+        while not done:
+            batch, done = self._take_batch(in_q, await in_q.get(), self.upload_batch.size)
+            while batch:
+                size = self.upload_batch.size
+                part = batch[:size]
+                start = time.monotonic()
+                try:
+                    response = await client.aindex_documents(self.index_name, part, max_retries=0, raise_on_throttle=True)
+                except ThrottledError as e:
+                    wait_time = self.upload_batch.on_throttle(len(part), e.retry_after)
+                    logger.warning(f"Upload throttled, batch size now {self.upload_batch.size}, waiting {wait_time}s")
+                    await asyncio.sleep(wait_time)
+                    continue
+                self.upload_batch.on_success()
+                stats.record(len(part), time.monotonic() - start)
+                batch = batch[size:]
+                if "value" not in response:
+                    logger.error(f"Upload batch failed: {response.get('error', response)}")
+                    self.failed.extend(action["id"] for action in part)
+                    continue
+                for r in response["value"]:
+                    if not r.get("status"):
+                        logger.warning(f"Failed to index {r.get('key')}: {r.get('statusCode')} {r.get('errorMessage')}")
+                        self.failed.append(r.get("key"))
+
+    async def _run_stage(self, name: str, worker: Callable, in_q: asyncio.Queue, out_q: Optional[asyncio.Queue], downstream_workers: int) -> None:
+        stats = self._stats[name]
+        stats.started = time.monotonic()
+        await asyncio.gather(*(worker(in_q, out_q) for _ in range(self.workers[name])))
+        stats.finished = time.monotonic()
+        if out_q is not None:
+            for _ in range(downstream_workers):
+                await out_q.put(_DONE)
+
+    async def _feed(self, documents: Iterable[Tuple[str, Any]], queue: asyncio.Queue) -> None:
+        for item in documents:
+            await queue.put(item)
+        for _ in range(self.workers["parse"]):
+            await queue.put(_DONE)
+
+    async def arun(self, documents: Union[Dict[str, Any], Iterable[Tuple[str, Any]]]) -> Dict[str, Any]:
+        """Runs the pipeline to completion and returns per-stage throughput stats"""
+        if isinstance(documents, dict):
+            documents = documents.items()
+        self.failed = []
+        self._stats = {name: _StageStats(name, workers) for name, workers in self.workers.items()}
+        queues = [asyncio.Queue(maxsize=self.queue_size) for _ in range(4)]
+        stages = [("parse", self._parse_worker), ("chunk", self._chunk_worker),
+                  ("embed", self._embed_worker), ("upload", self._upload_worker)]
+        start = time.monotonic()
+        tasks = [asyncio.ensure_future(self._feed(documents, queues[0]))]
+        for i, (name, worker) in enumerate(stages):
+            out_q = queues[i + 1] if i + 1 < len(stages) else None
+            downstream_workers = self.workers[stages[i + 1][0]] if out_q is not None else 0
+            tasks.append(asyncio.ensure_future(self._run_stage(name, worker, queues[i], out_q, downstream_workers)))
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+        stats = self.stats()
+        stats["total_seconds"] = time.monotonic() - start
+        if self.verbose: print(json.dumps(stats, indent=2))
+        return stats
+
+    def run(self, documents: Union[Dict[str, Any], Iterable[Tuple[str, Any]]]) -> Dict[str, Any]:
+        return asyncio.run(self.arun(documents))
+
+    def stats(self) -> Dict[str, Any]:
+        return {"stages": {name: stats.as_dict() for name, stats in self._stats.items()},
+                "embed_batch_size": self.embed_batch.size, "embed_throttles": self.embed_batch.throttles,
+                "upload_batch_size": self.upload_batch.size, "upload_throttles": self.upload_batch.throttles,
+                "failed": len(self.failed)}
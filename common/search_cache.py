@@ -0,0 +1,246 @@
+# search_cache.py
+# -----------------------------------------------------------------------------
+# Result caches for the multi-index hybrid search in utils.get_search_results.
+#   - InMemorySearchCache: bounded LRU with per-entry TTL (default)
+#   - RedisSearchCache: same interface on top of any Redis-compatible client
+#   - SemanticQueryCache: embedding-similarity cache for paraphrased queries
+# -----------------------------------------------------------------------------
+
+import re
+import copy
+import asyncio
+import json
+import time
+import hashlib
+import threading
+import logging
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_query(query: str) -> str:
+    """Lower-cases the query and collapses whitespace so trivial variations share a cache entry"""
+    return re.sub(r"\s+", " ", query.strip().lower())
+
+
+class SearchResultCache(ABC):
+    """
+    Base class for search result caches.
+    Keys are built from the normalized query, the index list and the search parameters;
+    values are the ordered dictionaries returned by get_search_results.
+    """
+
+    def __init__(self, ttl: Optional[float] = 300):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(query: str, indexes: List[str], **params: Any) -> str:
+        """Builds a stable cache key. Any keyword parameter (k, filter, threshold, ...) becomes part of the key."""
+        key_data = {"query": normalize_query(query), "indexes": sorted(indexes), "params": params}
+        return hashlib.sha256(json.dumps(key_data, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[OrderedDict]:
+        value = self._get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key: str, value: Dict[str, Any]) -> None:
+        self._set(key, value)
+
+    @abstractmethod
+    def _get(self, key: str) -> Optional[OrderedDict]:
+        pass
+
+    @abstractmethod
+    def _set(self, key: str, value: Dict[str, Any]) -> None:
+        pass
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0}
+
+
+class InMemorySearchCache(SearchResultCache):
+    """Thread-safe LRU cache with a maximum number of entries and a per-entry TTL"""
+
+    def __init__(self, max_entries: int = 1024, ttl: Optional[float] = 300):
+        super().__init__(ttl=ttl)
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def _get(self, key: str) -> Optional[OrderedDict]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+        # Hand out a copy so callers can't mutate the cached results
+        return copy.deepcopy(value)
+
+    def _set(self, key: str, value: Dict[str, Any]) -> None:
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        value = copy.deepcopy(value)
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, Any]:
+        return {**super().stats(), "entries": len(self._entries),
+                "max_entries": self.max_entries, "evictions": self.evictions}
+
+
+class RedisSearchCache(SearchResultCache):
+    """
+    Cache backed by a Redis-compatible client (redis.Redis, fakeredis, or anything exposing
+    get(name) and set(name, value, ex=seconds)). Eviction is left to the server's maxmemory policy.
+    """
+
+    def __init__(self, client: Any, ttl: Optional[float] = 300, prefix: str = "search:"):
+        super().__init__(ttl=ttl)
+        self.client = client
+        self.prefix = prefix
+
+    def _get(self, key: str) -> Optional[OrderedDict]:
+        raw = self.client.get(self.prefix + key)
+        if raw is None:
+            return None
+        return OrderedDict(json.loads(raw))
+
+    def _set(self, key: str, value: Dict[str, Any]) -> None:
+        ex = max(1, int(self.ttl)) if self.ttl else None
+        self.client.set(self.prefix + key, json.dumps(value), ex=ex)
+
+
+class SemanticQueryCache:
+    """
+    Semantic cache that reuses results for paraphrased queries.
+
+    Incoming queries are embedded with a pluggable embedder (any object with embed_query(text), e.g.
+    AzureOpenAIEmbeddings, or langchain_core's DeterministicFakeEmbedding in tests) and compared against
+    recent queries kept in a fixed-capacity float32 matrix. Similarity, expiry and eviction are vectorized.
+    Entries only match within the same scope, so results for different indexes/k/filters never mix.
+    """
+
+    def __init__(self, embedder: Any, capacity: int = 1024, threshold: float = 0.95, ttl: Optional[float] = 3600):
+        self.embedder = embedder
+        self.capacity = capacity
+        self.threshold = threshold
+        self.ttl = ttl
+        self._vectors = None  # (capacity, dim) L2-normalized rows, allocated on first insert
+        self._scopes = np.zeros(capacity, dtype=np.int64)
+        self._expires = np.full(capacity, -np.inf)  # -inf marks an empty slot
+        self._last_used = np.zeros(capacity)
+        self._values = [None] * capacity
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_scope(**params: Any) -> int:
+        """Hashes the non-query search parameters into an int64 scope id"""
+        digest = hashlib.sha256(json.dumps(params, sort_keys=True, default=str).encode("utf-8")).digest()
+        return int.from_bytes(digest[:8], "little", signed=True)
+
+    @staticmethod
+    def _normalize(vector: Any) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def embed(self, query: str) -> np.ndarray:
+        return self._normalize(self.embedder.embed_query(normalize_query(query)))
+
+    async def aembed(self, query: str) -> np.ndarray:
+        if hasattr(self.embedder, "aembed_query"):
+            return self._normalize(await self.embedder.aembed_query(normalize_query(query)))
+        # Sync-only embedders make a blocking network call, keep it off the event loop
+        return await asyncio.to_thread(self.embed, query)
+
+    def _best_match(self, vector: np.ndarray, scope: int, now: float) -> Tuple[int, float]:
+        """Returns the slot and similarity of the closest live entry in the scope (-1 if none)"""
+        if self._vectors is None:
+            return -1, -np.inf
+        live = (self._expires > now) & (self._scopes == scope)
+        if not live.any():
+            return -1, -np.inf
+        similarities = np.where(live, self._vectors @ vector, -np.inf)
+        slot = int(np.argmax(similarities))
+        return slot, float(similarities[slot])
+
+    def lookup_vector(self, vector: np.ndarray, scope: int = 0) -> Optional[Any]:
+        now = time.monotonic()
+        with self._lock:
+            slot, similarity = self._best_match(vector, scope, now)
+            if slot >= 0 and similarity >= self.threshold:
+                self.hits += 1
+                self._last_used[slot] = now
+                return copy.deepcopy(self._values[slot])
+            self.misses += 1
+            return None
+
+    def lookup(self, query: str, scope: int = 0) -> Tuple[Optional[Any], np.ndarray]:
+        """Returns (cached value or None, query vector). Pass the vector back to add() on a miss."""
+        vector = self.embed(query)
+        return self.lookup_vector(vector, scope), vector
+
+    async def alookup(self, query: str, scope: int = 0) -> Tuple[Optional[Any], np.ndarray]:
+        vector = await self.aembed(query)
+        return self.lookup_vector(vector, scope), vector
+
+    def add(self, vector: np.ndarray, value: Any, scope: int = 0) -> None:
+        now = time.monotonic()
+        with self._lock:
+            if self._vectors is None:
+                self._vectors = np.zeros((self.capacity, vector.shape[0]), dtype=np.float32)
+            slot, similarity = self._best_match(vector, scope, now)
+            if slot < 0 or similarity < self.threshold:
+                # Reuse an empty/expired slot if there is one, otherwise evict the least recently used entry
+                free = self._expires <= now
+                slot = int(np.argmax(free)) if free.any() else int(np.argmin(self._last_used))
+            self._vectors[slot] = vector
+            self._scopes[slot] = scope
+            self._expires[slot] = now + self.ttl if self.ttl else np.inf
+            self._last_used[slot] = now
+            self._values[slot] = copy.deepcopy(value)
+
+    def get(self, query: str, scope: int = 0) -> Optional[Any]:
+        return self.lookup(query, scope)[0]
+
+    def set(self, query: str, value: Any, scope: int = 0) -> None:
+        self.add(self.embed(query), value, scope)
+
+    def __len__(self) -> int:
+        return int((self._expires > time.monotonic()).sum())
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self), "capacity": self.capacity}
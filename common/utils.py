@@ -2,31 +2,45 @@ import re
 import os
 import json
 import requests
+import aiohttp
 import asyncio
 import base64
 import shutil
 import zipfile
 import time
 import html
+import urllib.parse
+import heapq
+import hashlib
+import threading
 import tiktoken
+import functools
+import contextlib
+import numpy as np
 
 from time import sleep
 from io import BytesIO
-from typing import Any, Dict, List, Optional, Awaitable, Callable, Tuple, Type, Union
+from typing import Any, Dict, Iterator, List, Optional, Awaitable, Callable, Sequence, Tuple, Type, Union
 from operator import itemgetter
 from typing import List
 from pydantic import BaseModel, Field, Extra
 from pypdf import PdfReader, PdfWriter
+from pypdf.generic import ArrayObject, IndirectObject
 from dataclasses import dataclass
-from concurrent.futures import ThreadPoolExecutor
-from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from collections import OrderedDict, defaultdict, deque
 from tqdm import tqdm
 from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 from sqlalchemy.engine.url import URL
 from azure.ai.formrecognizer import DocumentAnalysisClient
 from azure.core.credentials import AzureKeyCredential
-from azure.storage.blob import BlobServiceClient, BlobClient, ContainerClient
+from azure.core.exceptions import HttpResponseError
+from azure.core.polling import PollingMethod
+from azure.core.polling.base_polling import LROBasePolling, BadStatus, BadResponse
+from azure.storage.blob import BlobServiceClient, BlobClient, ContainerClient, ContentSettings
 
 
 from langchain_core.tools import BaseTool, StructuredTool
@@ -35,7 +49,7 @@ from langchain_core.utils.json_schema import dereference_refs
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.retrievers import BaseRetriever
-from langchain_core.callbacks import CallbackManagerForRetrieverRun, Callbacks
+from langchain_core.callbacks import CallbackManagerForRetrieverRun, AsyncCallbackManagerForRetrieverRun, Callbacks
 from langchain_experimental.tools import PythonAstREPLTool
 
 
@@ -65,14 +79,51 @@ except Exception as e:
     from prompts import (DOCSEARCH_PROMPT_TEXT, CSV_AGENT_PROMPT_TEXT, MSSQL_AGENT_PROMPT_TEXT,
                          BING_PROMPT_TEXT, APISEARCH_PROMPT_TEXT)
 
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
+try:
+    from .search_cache import SearchResultCache, SemanticQueryCache
+except ImportError:
+    from search_cache import SearchResultCache, SemanticQueryCache
+try:
+    from .extraction_cache import PdfExtractionCache
+except ImportError:
+    from extraction_cache import PdfExtractionCache
+
     
+# Block size/single-put limits for blob uploads: files above max_single_put_size are sent as blocks in parallel
+BLOB_MAX_SINGLE_PUT_SIZE = 8 * 1024 * 1024
+BLOB_MAX_BLOCK_SIZE = 4 * 1024 * 1024
+
+
+def get_container_client(container_name, connection_string=None) -> ContainerClient:
+    """Builds a ContainerClient (thread-safe, reuse it across uploads) from BLOB_CONNECTION_STRING by default"""
+    blob_service_client = BlobServiceClient.from_connection_string(connection_string or os.environ['BLOB_CONNECTION_STRING'],
+                                                                   max_single_put_size=BLOB_MAX_SINGLE_PUT_SIZE,
+                                                                   max_block_size=BLOB_MAX_BLOCK_SIZE)
+    return blob_service_client.get_container_client(container_name)
+
+
+def _file_md5(file_path, chunk_size=1 << 20) -> bytes:
+    digest = hashlib.md5()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.digest()
+
+
 # Function to upload a single file
-def upload_file_to_blob(file_path, blob_name, container_name):
-    blob_service_client = BlobServiceClient.from_connection_string(os.environ['BLOB_CONNECTION_STRING'])
-    container_client = blob_service_client.get_container_client(container_name)
+def upload_file_to_blob(file_path, blob_name, container_name, container_client=None, max_concurrency=1, content_md5=None):
+    container_client = container_client or get_container_client(container_name)
     blob_client = container_client.get_blob_client(blob_name)
+    # Store the MD5 explicitly: the service only computes it for single-put uploads, and it's what lets reruns skip the file
+    content_settings = ContentSettings(content_md5=bytearray(content_md5 or _file_md5(file_path)))
     with open(file_path, "rb") as data:
-        blob_client.upload_blob(data, overwrite=True)
+        blob_client.upload_blob(data, overwrite=True, max_concurrency=max_concurrency, content_settings=content_settings)
 
 # Unzip the file to a temporary directory
 def extract_zip_file(zip_path, extract_to):
@@ -81,17 +132,117 @@ def extract_zip_file(zip_path, extract_to):
         zip_ref.extractall(extract_to)
     print(f"Extracted {zip_path} to {extract_to}")
 
-# Recursive function to upload all files in a directory with overall progress bar
-def upload_directory_to_blob(local_directory, container_name, container_folder=""):
-    total_files = sum([len(files) for _, _, files in os.walk(local_directory)])  # Get total number of files
-    with tqdm(total=total_files, desc="Uploading Files", ncols=100) as overall_progress:
-        for root, dirs, files in os.walk(local_directory):
-            for file in files:
-                file_path = os.path.join(root, file)
-                relative_path = os.path.relpath(file_path, local_directory)
-                blob_name = os.path.join(container_folder, relative_path).replace("\\", "/")  # Adjust path for Azure
-                upload_file_to_blob(file_path, blob_name, container_name)
+
+def _existing_blobs(container_client, prefix=""):
+    """Returns {blob name: (size, content md5)} for the blobs under prefix"""
+    return {blob.name: (blob.size, bytes(blob.content_settings.content_md5 or b""))
+            for blob in container_client.list_blobs(name_starts_with=prefix or None)}
+
+
+# Upload all files in a directory concurrently with overall progress bar
+def upload_directory_to_blob(local_directory, container_name, container_folder="", max_workers=8, skip_unchanged=True,
+                             max_concurrency=4, container_client=None):
+    """Uploads a directory tree with one shared ContainerClient and a bounded thread pool.
+    Files whose blob already has the same size and MD5 are skipped when skip_unchanged is set, and files
+    larger than BLOB_MAX_SINGLE_PUT_SIZE are uploaded as blocks with max_concurrency connections each.
+    Returns the upload stats."""
+    start = time.time()
+    container_client = container_client or get_container_client(container_name)
+    files = []
+    for root, dirs, filenames in os.walk(local_directory):
+        for file in filenames:
+            file_path = os.path.join(root, file)
+            relative_path = os.path.relpath(file_path, local_directory)
+            blob_name = os.path.join(container_folder, relative_path).replace("\\", "/")  # Adjust path for Azure
+            files.append((file_path, blob_name, os.path.getsize(file_path)))
+    existing = _existing_blobs(container_client, container_folder) if skip_unchanged else {}
+
+    def upload(file_path, blob_name, size):
+        md5 = _file_md5(file_path)
+        if existing.get(blob_name) == (size, md5):
+            return False
+        upload_file_to_blob(file_path, blob_name, container_name, container_client=container_client, content_md5=md5,
+                            max_concurrency=max_concurrency if size > BLOB_MAX_SINGLE_PUT_SIZE else 1)
+        return True
+
+    stats = {"files": len(files), "uploaded": 0, "skipped": 0, "failed": 0, "bytes_uploaded": 0}
+    with tqdm(total=len(files), desc="Uploading Files", ncols=100) as overall_progress:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(upload, *file): file for file in files}
+            for future in as_completed(futures):
+                file_path, blob_name, size = futures[future]
+                try:
+                    if future.result():
+                        stats["uploaded"] += 1
+                        stats["bytes_uploaded"] += size
+                    else:
+                        stats["skipped"] += 1
+                except Exception as e:
+                    logger.error(f"Failed to upload {file_path} to {blob_name}: {e}")
+                    stats["failed"] += 1
                 overall_progress.update(1)  # Update progress after each file is uploaded
+    stats["seconds"] = time.time() - start
+    stats["mb_per_second"] = stats["bytes_uploaded"] / 1e6 / stats["seconds"] if stats["seconds"] else 0.0
+    return stats
+
+# Upload the members of a zip archive concurrently, streaming them without extracting to disk
+def upload_zip_to_blob(zip_path, container_name, container_folder="", max_workers=8, skip_unchanged=True,
+                       max_concurrency=4, container_client=None):
+    """Streams every member of a zip archive from ZipFile.open straight into its blob, in parallel and
+    without scratch space on disk (each worker thread reads through its own ZipFile handle).
+    The member's CRC-32 is stored in the blob metadata, so with skip_unchanged members whose blob has the
+    same size and CRC-32 are skipped without being read. Returns the same stats as upload_directory_to_blob."""
+    start = time.time()
+    container_client = container_client or get_container_client(container_name)
+    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+        members = [info for info in zip_ref.infolist() if not info.is_dir()]
+    existing = {}
+    if skip_unchanged:
+        existing = {blob.name: (blob.size, (blob.metadata or {}).get("crc32"))
+                    for blob in container_client.list_blobs(name_starts_with=container_folder or None, include=["metadata"])}
+
+    local = threading.local()
+    handles = []
+    handles_lock = threading.Lock()
+
+    def upload(info):
+        blob_name = os.path.join(container_folder, info.filename).replace("\\", "/")  # Adjust path for Azure
+        crc32 = f"{info.CRC:08x}"
+        if existing.get(blob_name) == (info.file_size, crc32):
+            return False
+        if not hasattr(local, "zip_ref"):
+            local.zip_ref = zipfile.ZipFile(zip_path, 'r')
+            with handles_lock:
+                handles.append(local.zip_ref)
+        blob_client = container_client.get_blob_client(blob_name)
+        with local.zip_ref.open(info) as data:
+            blob_client.upload_blob(data, length=info.file_size, overwrite=True, metadata={"crc32": crc32},
+                                    max_concurrency=max_concurrency if info.file_size > BLOB_MAX_SINGLE_PUT_SIZE else 1)
+        return True
+
+    stats = {"files": len(members), "uploaded": 0, "skipped": 0, "failed": 0, "bytes_uploaded": 0}
+    try:
+        with tqdm(total=len(members), desc="Uploading Files", ncols=100) as overall_progress:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = {executor.submit(upload, info): info for info in members}
+                for future in as_completed(futures):
+                    info = futures[future]
+                    try:
+                        if future.result():
+                            stats["uploaded"] += 1
+                            stats["bytes_uploaded"] += info.file_size
+                        else:
+                            stats["skipped"] += 1
+                    except Exception as e:
+                        logger.error(f"Failed to upload {info.filename} from {zip_path}: {e}")
+                        stats["failed"] += 1
+                    overall_progress.update(1)
+    finally:
+        for handle in handles:
+            handle.close()
+    stats["seconds"] = time.time() - start
+    stats["mb_per_second"] = stats["bytes_uploaded"] / 1e6 / stats["seconds"] if stats["seconds"] else 0.0
+    return stats
 
 def text_to_base64(text):
     # Convert text to bytes using UTF-8 encoding
@@ -106,104 +257,427 @@ def text_to_base64(text):
     return base64_text
 
 def table_to_html(table):
-    table_html = "<table>"
-    rows = [sorted([cell for cell in table.cells if cell.row_index == i], key=lambda cell: cell.column_index) for i in range(table.row_count)]
+    # Bucket the cells by row in a single pass instead of rescanning all cells for every row
+    rows = [[] for _ in range(table.row_count)]
+    for cell in table.cells:
+        if cell.row_index < table.row_count:
+            rows[cell.row_index].append(cell)
+    table_html = ["<table>"]
     for row_cells in rows:
-        table_html += "<tr>"
-        for cell in row_cells:
+        table_html.append("<tr>")
+        for cell in sorted(row_cells, key=lambda cell: cell.column_index):
             tag = "th" if (cell.kind == "columnHeader" or cell.kind == "rowHeader") else "td"
             cell_spans = ""
             if cell.column_span > 1: cell_spans += f" colSpan={cell.column_span}"
             if cell.row_span > 1: cell_spans += f" rowSpan={cell.row_span}"
-            table_html += f"<{tag}{cell_spans}>{html.escape(cell.content)}</{tag}>"
-        table_html +="</tr>"
-    table_html += "</table>"
-    return table_html
+            table_html.append(f"<{tag}{cell_spans}>{html.escape(cell.content)}</{tag}>")
+        table_html.append("</tr>")
+    table_html.append("</table>")
+    return "".join(table_html)
+
+
+def _tables_by_page(form_recognizer_results) -> Dict[int, list]:
+    """Groups the Document Intelligence tables by the (1-based) page they start on, in one pass"""
+    tables_by_page = defaultdict(list)
+    for table in form_recognizer_results.tables:
+        tables_by_page[table.bounding_regions[0].page_number].append(table)
+    return tables_by_page
+
+
+def _build_page_text(content: str, page, tables_on_page: list) -> str:
+    """Builds the page text replacing the characters in table spans with the table html.
+    Slices the content between the sorted table spans in whole ranges and joins once."""
+    page_offset = page.spans[0].offset
+    page_end = page_offset + page.spans[0].length
+    
+    # (start, end, table_id) of every table span, clipped to the page
+    table_spans = []
+    for table_id, table in enumerate(tables_on_page):
+        for span in table.spans:
+            start, end = max(span.offset, page_offset), min(span.offset + span.length, page_end)
+            if start < end:
+                table_spans.append((start, end, table_id))
+    table_spans.sort()
+    
+    parts = []
+    added_tables = set()
+    cursor = page_offset
+    for start, end, table_id in table_spans:
+        if start > cursor:
+            parts.append(content[cursor:start])
+        if table_id not in added_tables:
+            parts.append(table_to_html(tables_on_page[table_id]))
+            added_tables.add(table_id)
+        cursor = max(cursor, end)
+    parts.append(content[cursor:page_end])
+    return "".join(parts)
                 
-# Function that uses PyPDF of Azure Form Recognizer to parse PDFs
-def parse_pdf(file, form_recognizer=False, formrecognizer_endpoint=None, formrecognizerkey=None, model="prebuilt-document", from_url=False, verbose=False):
-    """Parses PDFs using PyPDF or Azure Document Intelligence SDK (former Azure Form Recognizer)"""
+def _pdf_source(file):
+    """Returns something a worker process can open: the path for str inputs, the raw bytes for file-like objects"""
+    if isinstance(file, str):
+        return file
+    if hasattr(file, "getvalue"):
+        return file.getvalue()
+    # Send the whole file wherever the handle currently is
+    position = file.tell()
+    file.seek(0)
+    try:
+        return file.read()
+    finally:
+        file.seek(position)
+
+
+def _open_pdf(source) -> PdfReader:
+    return PdfReader(source if isinstance(source, str) else BytesIO(source))
+
+
+def _extract_pdf_page_range(source, start: int, end: int) -> List[Tuple[int, str]]:
+    """Worker task: extracts the text of pages [start, end) of one PDF"""
+    reader = _open_pdf(source)
+    return [(page_num, reader.pages[page_num].extract_text()) for page_num in range(start, end)]
+
+
+def _extract_pdf_first_pages(source, pages_per_task: int) -> Tuple[int, List[Tuple[int, str]]]:
+    """Worker task: counts the pages of one PDF and extracts the first pages_per_task of them.
+    In-memory PDFs are extracted whole, so their bytes are sent to a worker only once."""
+    reader = _open_pdf(source)
+    page_count = len(reader.pages)
+    end = min(page_count, pages_per_task) if isinstance(source, str) else page_count
+    return page_count, [(page_num, reader.pages[page_num].extract_text()) for page_num in range(end)]
+
+
+def extract_pdf_pages_parallel(files, max_workers=None, pages_per_task=25, verbose=False) -> List[List[Tuple[int, int, str]]]:
+    """Extracts the text of PDFs with PyPDF on a process pool, splitting the work by file and by page range.
+    Workers open the PDFs and count their pages: paths are sent as paths, and the first task of a long file
+    queues page-range tasks for the rest of it, while file-like objects are read only when their (single)
+    task is submitted. At most 2 * max_workers tasks are in flight. Pages are reassembled in order and offsets
+    computed afterwards, so every returned page_map is identical to the serial PyPDF output of parse_pdf."""
+    
+    max_workers = max_workers or os.cpu_count() or 1
+    files = list(files)
+    if verbose: print(f"Extracting text from {len(files)} PDFs using PyPDF on {max_workers} processes")
+    
+    texts = [None] * len(files)
+    remaining_files = iter(enumerate(files))
+    page_ranges = deque()  # (file_idx, start, end) of long files whose page count is known
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        pending = {}
+        while True:
+            while len(pending) < 2 * max_workers:
+                if page_ranges:
+                    file_idx, start, end = page_ranges.popleft()
+                    future = executor.submit(_extract_pdf_page_range, files[file_idx], start, end)
+                else:
+                    file_idx, file = next(remaining_files, (None, None))
+                    if file_idx is None:
+                        break
+                    future = executor.submit(_extract_pdf_first_pages, _pdf_source(file), pages_per_task)
+                pending[future] = file_idx
+            if not pending:
+                break
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                file_idx = pending.pop(future)
+                pages = future.result()
+                if texts[file_idx] is None:
+                    page_count, pages = pages
+                    texts[file_idx] = [None] * page_count
+                    page_ranges.extend((file_idx, start, min(start + pages_per_task, page_count))
+                                       for start in range(len(pages), page_count, pages_per_task))
+                for page_num, page_text in pages:
+                    texts[file_idx][page_num] = page_text
+    
+    page_maps = []
+    for file_texts in texts:
+        offset = 0
+        page_map = []
+        for page_num, page_text in enumerate(file_texts):
+            page_map.append((page_num, offset, page_text))
+            offset += len(page_text)
+        page_maps.append(page_map)
+    if verbose: print(f"Extracted {sum(len(page_map) for page_map in page_maps)} pages")
+    return page_maps
+
+
+def _release_page_contents(reader: PdfReader, page) -> None:
+    """Drops the page's (already extracted) content streams from the reader's object cache to keep memory flat"""
+    contents = page.get("/Contents")
+    for ref in (contents if isinstance(contents, ArrayObject) else [contents]):
+        if isinstance(ref, IndirectObject):
+            reader.resolved_objects.pop((ref.generation, ref.idnum), None)
+
+
+def _get_form_recognizer_client(endpoint=None, key=None) -> DocumentAnalysisClient:
+    """Builds a Document Intelligence client from the given endpoint/key, falling back to the environment"""
+    credential = AzureKeyCredential(key or os.environ["FORM_RECOGNIZER_KEY"])
+    return DocumentAnalysisClient(endpoint=endpoint or os.environ["FORM_RECOGNIZER_ENDPOINT"], credential=credential)
+
+
+def _begin_analyze(form_recognizer_client, file, model="prebuilt-document", from_url=False, **kwargs):
+    """Submits a document (path, stream or URL) for analysis and returns the poller"""
+    if from_url:
+        return form_recognizer_client.begin_analyze_document_from_url(model, document_url=file, **kwargs)
+    # If file is a string (file path), open it normally; if it's a stream (BytesIO, UploadedFile), pass it directly
+    if isinstance(file, str):
+        with open(file, "rb") as filename:
+            return form_recognizer_client.begin_analyze_document(model, document=filename, **kwargs)
+    return form_recognizer_client.begin_analyze_document(model, document=file, **kwargs)
+
+
+def _iter_form_recognizer_pages(form_recognizer_results) -> Iterator[Tuple[int, int, str]]:
+    """Rebuilds (page_num, offset, page_text) tuples, with tables as HTML, from an analysis result"""
+    offset = 0
+    tables_by_page = _tables_by_page(form_recognizer_results)
+    for page_num, page in enumerate(form_recognizer_results.pages):
+        page_text = _build_page_text(form_recognizer_results.content, page, tables_by_page.get(page_num + 1, []))
+        page_text += " "
+        yield (page_num, offset, page_text)
+        offset += len(page_text)
+
+
+class _RateLimiter:
+    """Thread-safe limiter that spaces calls at least 1/rate seconds apart"""
+
+    def __init__(self, rate: Optional[float] = None):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self) -> None:
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+class _BackoffPolling(PollingMethod):
+    """LRO polling method that doubles the delay between status polls, from interval up to max_interval.
+    Wraps an LROBasePolling through its public interface: the status polls go through update_status(), and once
+    the operation is done the inner run() only does what is left (raise on a failed or canceled operation, final GET)."""
+
+    def __init__(self, interval: float, max_interval: float, **kwargs):
+        self._polling = LROBasePolling(timeout=interval, **kwargs)
+        self._interval = interval
+        self._max_interval = max_interval
+
+    def initialize(self, client: Any, initial_response: Any, deserialization_callback: Callable) -> None:
+        self._polling.initialize(client, initial_response, deserialization_callback)
+
+    def run(self) -> None:
+        delay = self._interval
+        while not self._polling.finished():
+            time.sleep(delay)
+            delay = min(delay * 2, self._max_interval)
+            try:
+                self._polling.update_status()
+            except (BadStatus, BadResponse) as e:
+                raise HttpResponseError(message=str(e), error=e) from e
+        self._polling.run()
+
+    def status(self) -> str:
+        return self._polling.status()
+
+    def finished(self) -> bool:
+        return self._polling.finished()
+
+    def resource(self) -> Any:
+        return self._polling.resource()
+
+    def get_continuation_token(self) -> str:
+        return self._polling.get_continuation_token()
+
+    @classmethod
+    def from_continuation_token(cls, continuation_token: str, **kwargs: Any) -> Tuple[Any, Any, Callable]:
+        return LROBasePolling.from_continuation_token(continuation_token, **kwargs)
+
+
+def _analyze_and_wait(form_recognizer_client, file, model, from_url, limiter, poll_interval, max_poll_interval):
+    """Submits one document once the rate limiter allows it and polls its status with exponential backoff"""
+    limiter.wait()
+    poller = _begin_analyze(form_recognizer_client, file, model, from_url,
+                            polling=_BackoffPolling(poll_interval, max_poll_interval))
+    return list(_iter_form_recognizer_pages(poller.result()))
+
+
+# Generator that analyzes many documents with Azure Document Intelligence concurrently
+def analyze_documents(files, model="prebuilt-document", from_url=False, max_concurrency=4, rate_limit=None,
+                      poll_interval=1.0, max_poll_interval=15.0, formrecognizer_endpoint=None, formrecognizerkey=None,
+                      client=None, verbose=False) -> Iterator[Tuple[Any, List[Tuple[int, int, str]]]]:
+    """
+    Keeps up to max_concurrency documents in flight and yields (file, page_map) as each analysis completes,
+    in completion order. rate_limit caps submissions per second to stay under the resource's quota.
+    page_map has the same (page_num, offset, page_text) format as parse_pdf.
+    """
+    files = list(files)
+    for position, page_map in _analyze_documents(files, model, from_url, max_concurrency, rate_limit, poll_interval,
+                                                 max_poll_interval, formrecognizer_endpoint, formrecognizerkey,
+                                                 client, verbose):
+        yield files[position], page_map
+
+
+def _analyze_documents(files, model="prebuilt-document", from_url=False, max_concurrency=4, rate_limit=None,
+                       poll_interval=1.0, max_poll_interval=15.0, formrecognizer_endpoint=None, formrecognizerkey=None,
+                       client=None, verbose=False) -> Iterator[Tuple[int, List[Tuple[int, int, str]]]]:
+    """analyze_documents, yielding the position of each file in files instead of the file itself"""
+    form_recognizer_client = client or _get_form_recognizer_client(formrecognizer_endpoint, formrecognizerkey)
+    limiter = _RateLimiter(rate_limit)
+    pending = iter(enumerate(files))
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        in_flight = {}
+
+        def submit_next():
+            position, file = next(pending, (None, None))
+            if position is not None:
+                future = executor.submit(_analyze_and_wait, form_recognizer_client, file, model, from_url,
+                                         limiter, poll_interval, max_poll_interval)
+                in_flight[future] = position
+
+        for _ in range(max_concurrency):
+            submit_next()
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                position = in_flight.pop(future)
+                submit_next()
+                page_map = future.result()
+                if verbose: print(f"Analyzed {getattr(files[position], 'name', files[position])}: {len(page_map)} pages")
+                yield position, page_map
+
+
+# Generator that uses PyPDF or Azure Form Recognizer to parse PDFs page by page
+def iter_pdf_pages(file, form_recognizer=False, formrecognizer_endpoint=None, formrecognizerkey=None, model="prebuilt-document", from_url=False, verbose=False) -> Iterator[Tuple[int, int, str]]:
+    """Yields (page_num, offset, page_text) tuples as the pages are extracted, so callers can process
+    large documents without holding every page's text in memory at once"""
     offset = 0
-    page_map = []
     if not form_recognizer:
         if verbose: print(f"Extracting text using PyPDF")
-        reader = PdfReader(file)
-        pages = reader.pages
-        for page_num, p in enumerate(pages):
-            page_text = p.extract_text()
-            page_map.append((page_num, offset, page_text))
-            offset += len(page_text)
+        # PdfReader loads a whole file into memory when given a path, but reads lazily from an open handle
+        with (open(file, "rb") if isinstance(file, str) else contextlib.nullcontext(file)) as stream:
+            reader = PdfReader(stream)
+            pages = reader.pages
+            for page_num, p in enumerate(pages):
+                page_text = p.extract_text()
+                _release_page_contents(reader, p)
+                yield (page_num, offset, page_text)
+                offset += len(page_text)
     else:
         if verbose: print(f"Extracting text using Azure Document Intelligence")
-        credential = AzureKeyCredential(os.environ["FORM_RECOGNIZER_KEY"])
-        form_recognizer_client = DocumentAnalysisClient(endpoint=os.environ["FORM_RECOGNIZER_ENDPOINT"], credential=credential)
-        
-        if not from_url:
-            # If file is a string (file path), open it normally; if it's BytesIO, pass it directly
-            if isinstance(file, str):
-                with open(file, "rb") as filename:
-                    poller = form_recognizer_client.begin_analyze_document(model, document=filename)
-            elif isinstance(file, BytesIO):
-                poller = form_recognizer_client.begin_analyze_document(model, document=file)
-        else:
-            poller = form_recognizer_client.begin_analyze_document_from_url(model, document_url = file)
-            
-        form_recognizer_results = poller.result()
-
-        for page_num, page in enumerate(form_recognizer_results.pages):
-            tables_on_page = [table for table in form_recognizer_results.tables if table.bounding_regions[0].page_number == page_num + 1]
-
-            # mark all positions of the table spans in the page
-            page_offset = page.spans[0].offset
-            page_length = page.spans[0].length
-            table_chars = [-1]*page_length
-            for table_id, table in enumerate(tables_on_page):
-                for span in table.spans:
-                    # replace all table spans with "table_id" in table_chars array
-                    for i in range(span.length):
-                        idx = span.offset - page_offset + i
-                        if idx >=0 and idx < page_length:
-                            table_chars[idx] = table_id
-
-            # build page text by replacing charcters in table spans with table html
-            page_text = ""
-            added_tables = set()
-            for idx, table_id in enumerate(table_chars):
-                if table_id == -1:
-                    page_text += form_recognizer_results.content[page_offset + idx]
-                elif not table_id in added_tables:
-                    page_text += table_to_html(tables_on_page[table_id])
-                    added_tables.add(table_id)
-
-            page_text += " "
-            page_map.append((page_num, offset, page_text))
-            offset += len(page_text)
+        form_recognizer_client = _get_form_recognizer_client(formrecognizer_endpoint, formrecognizerkey)
+        form_recognizer_results = _begin_analyze(form_recognizer_client, file, model, from_url).result()
+        yield from _iter_form_recognizer_pages(form_recognizer_results)
 
+def _extraction_cache_key(cache: PdfExtractionCache, file, form_recognizer=False, model="prebuilt-document") -> str:
+    if form_recognizer:
+        return cache.key_for(file, "document-intelligence", model)
+    return cache.key_for(file, "pypdf")
+
+
+# Function that uses PyPDF of Azure Form Recognizer to parse PDFs
+def parse_pdf(file, form_recognizer=False, formrecognizer_endpoint=None, formrecognizerkey=None, model="prebuilt-document", from_url=False, verbose=False, max_workers=None, cache: Optional[PdfExtractionCache] = None):
+    """Parses PDFs using PyPDF or Azure Document Intelligence SDK (former Azure Form Recognizer).
+    With max_workers > 1 the PyPDF extraction is split by page range across a process pool.
+    With a cache, unchanged files (same content, extractor and model) are not parsed again.
+    Use iter_pdf_pages to stream the pages instead of building the whole page_map."""
+    key = None
+    if cache is not None and not from_url:
+        key = _extraction_cache_key(cache, file, form_recognizer, model)
+        page_map = cache.get(key)
+        if page_map is not None:
+            if verbose: print(f"Using cached extraction")
+            return page_map
+    
+    if not form_recognizer and max_workers and max_workers > 1:
+        page_map = extract_pdf_pages_parallel([file], max_workers=max_workers, verbose=verbose)[0]
+    else:
+        page_map = list(iter_pdf_pages(file, form_recognizer=form_recognizer, formrecognizer_endpoint=formrecognizer_endpoint,
+                                       formrecognizerkey=formrecognizerkey, model=model, from_url=from_url, verbose=verbose))
+    if key is not None:
+        cache.set(key, page_map)
     return page_map    
 
 
-def read_pdf_files(files, form_recognizer=False, verbose=False, formrecognizer_endpoint=None, formrecognizerkey=None):
-    """This function will go through pdf and extract and return list of page texts (chunks)."""
+def read_pdf_files(files, form_recognizer=False, verbose=False, formrecognizer_endpoint=None, formrecognizerkey=None, max_workers=None, cache: Optional[PdfExtractionCache] = None):
+    """This function will go through pdf and extract and return list of page texts (chunks).
+    With max_workers > 1 the PyPDF extraction runs on a process pool (see extract_pdf_pages_parallel),
+    and Document Intelligence analyzes up to max_workers documents concurrently (see analyze_documents).
+    With a cache, only the files missing from it are parsed."""
     text_list = []
     sources_list = []
-    for file in files:
-        page_map = parse_pdf(file, form_recognizer=form_recognizer, verbose=verbose, formrecognizer_endpoint=formrecognizer_endpoint, formrecognizerkey=formrecognizerkey)
-        for page in enumerate(page_map):
-            text_list.append(page[1][2])
-            sources_list.append(file.name + "_page_"+str(page[1][0]+1))
+    # Everything is keyed by position in files: the same file may be listed twice
+    files = list(files)
+    page_maps = [None] * len(files)
+    keys = [None] * len(files)
+    if cache is not None:
+        for position, file in enumerate(files):
+            keys[position] = _extraction_cache_key(cache, file, form_recognizer)
+            page_maps[position] = cache.get(keys[position])
+        if verbose: print(f"{sum(page_map is not None for page_map in page_maps)} of {len(files)} files found in the extraction cache")
+    misses = [position for position, page_map in enumerate(page_maps) if page_map is None]
+    miss_files = [files[position] for position in misses]
+    
+    if not misses:
+        extracted = []
+    elif not form_recognizer and max_workers and max_workers > 1:
+        extracted = zip(misses, extract_pdf_pages_parallel(miss_files, max_workers=max_workers, verbose=verbose))
+    elif form_recognizer and max_workers and max_workers > 1:
+        # Results arrive in completion order; page_maps puts them back in input order below
+        extracted = ((misses[i], page_map) for i, page_map in _analyze_documents(
+            miss_files, max_concurrency=max_workers, formrecognizer_endpoint=formrecognizer_endpoint,
+            formrecognizerkey=formrecognizerkey, verbose=verbose))
+    else:
+        # Stream the pages straight into the output lists instead of building an intermediate page_map per file
+        extracted = ((position, iter_pdf_pages(files[position], form_recognizer=form_recognizer, verbose=verbose, formrecognizer_endpoint=formrecognizer_endpoint, formrecognizerkey=formrecognizerkey))
+                     for position in misses)
+    for position, page_map in extracted:
+        if cache is not None:
+            page_map = list(page_map)
+            cache.set(keys[position], page_map)
+        page_maps[position] = page_map
+    
+    for file, page_map in zip(files, page_maps):
+        for page_num, offset, page_text in page_map:
+            text_list.append(page_text)
+            sources_list.append(file.name + "_page_"+str(page_num+1))
     return [text_list,sources_list]
     
     
 
+# Model name prefixes (including common Azure deployment spellings) tokenized with o200k_base
+O200K_MODEL_PREFIXES = ("gpt-4o", "gpt4o", "gpt-4.1", "gpt-5", "o1", "o3", "o4")
+
+@functools.lru_cache(maxsize=None)
+def get_token_encoder(model: Optional[str] = None) -> tiktoken.Encoding:
+    """Returns a cached tiktoken encoder for a model, deployment or encoding name (cl100k_base by default)"""
+    if not model:
+        return tiktoken.get_encoding('cl100k_base')
+    if model in ("o200k_base", "cl100k_base"):
+        return tiktoken.get_encoding(model)
+    if model.lower().startswith(O200K_MODEL_PREFIXES):
+        return tiktoken.get_encoding('o200k_base')
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding('cl100k_base')
+
+
 # Returns the num of tokens used on a string
-def num_tokens_from_string(string: str) -> int:
-    encoding_name ='cl100k_base'
+def num_tokens_from_string(string: str, model: Optional[str] = None) -> int:
     """Returns the number of tokens in a text string."""
-    encoding = tiktoken.get_encoding(encoding_name)
-    num_tokens = len(encoding.encode(string))
+    encoding = get_token_encoder(model)
+    num_tokens = len(encoding.encode_ordinary(string))
     return num_tokens
 
 
+def num_tokens_from_strings(strings: List[str], model: Optional[str] = None, num_threads: int = 8) -> List[int]:
+    """Returns the number of tokens of each string, encoding the whole list in one multi-threaded batch call."""
+    encoding = get_token_encoder(model)
+    return [len(tokens) for tokens in encoding.encode_ordinary_batch(list(strings), num_threads=num_threads)]
+
+
 @dataclass(frozen=True)
 class ReducedOpenAPISpec:
     """A reduced OpenAPI spec.
@@ -273,74 +747,606 @@ def reduce_openapi_spec(spec: dict, dereference: bool = True) -> ReducedOpenAPIS
     )
 
 
-def get_search_results(query: str, indexes: list, 
-                       search_filter: str = "",
-                       k: int = 5,
-                       reranker_threshold: float = 1,
-                       sas_token: str = "") -> List[dict]:
-    """Performs multi-index hybrid search and returns ordered dictionary with the combined results"""
-    
-    headers = {'Content-Type': 'application/json','api-key': os.environ["AZURE_SEARCH_KEY"]}
-    params = {'api-version': os.environ['AZURE_SEARCH_API_VERSION']}
-
-    agg_search_results = dict()
-    
-    for index in indexes:
-        search_payload = {
-            "search": query,
-            "select": "id, title, chunk, name, location",
-            "queryType": "semantic",
-            "vectorQueries": [{"text": query, "fields": "chunkVector", "kind": "text", "k": k}],
-            "semanticConfiguration": "my-semantic-config",
-            "captions": "extractive",
-            "answers": "extractive",
-            "count":"true",
-            "top": k    
-        }
-        
-        if search_filter:
-            search_payload["filter"] = search_filter
+class ThrottledError(Exception):
+    """Raised when a service keeps answering 429/503; retry_after holds the server's hint in seconds, if any"""
+    
+    def __init__(self, status_code: int, retry_after: Optional[float] = None):
+        super().__init__(f"Throttled with status {status_code}" + (f", retry after {retry_after}s" if retry_after else ""))
+        self.status_code = status_code
+        self.retry_after = retry_after
 
-        resp = requests.post(os.environ['AZURE_SEARCH_ENDPOINT'] + "/indexes/" + index + "/docs/search",
-                         data=json.dumps(search_payload), headers=headers, params=params)
 
-        search_results = resp.json()
-        agg_search_results[index] = search_results
-        
-        
-    if not any("value" in results for results in agg_search_results.values()):
-        logger.warning("Empty Search Response")
-        return {}
+class AzureSearchClient:
+    """Pooled HTTP client for Azure AI Search.
+    
+    Holds a keep-alive requests.Session for sync calls and an aiohttp.ClientSession for async calls,
+    both with a bounded connection pool, gzip response decoding and bounded retries on 429/503.
+    Responses are decoded with orjson when it is installed.
+    Endpoint, key and api-version default to the AZURE_SEARCH_* environment variables.
+    """
     
-    content = dict()
-    ordered_content = OrderedDict()
+    RETRY_STATUSES = (429, 503)
     
-    for index,search_results in agg_search_results.items():
-        for result in search_results['value']:
-            if result['@search.rerankerScore'] > reranker_threshold: # Show results that are at least N% of the max possible score=4
-                content[result['id']]={
+    def __init__(self, endpoint: Optional[str] = None, api_key: Optional[str] = None, api_version: Optional[str] = None,
+                 pool_size: int = 10, max_retries: int = 3, backoff_factor: float = 0.5, keepalive_timeout: float = 30):
+        self._endpoint = endpoint
+        self._api_key = api_key
+        self._api_version = api_version
+        self.pool_size = pool_size
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.keepalive_timeout = keepalive_timeout
+        
+        self._lock = threading.Lock()
+        self._session = None
+        self._async_session = None
+        self._async_loop = None
+        self._sync_stats = {"requests": 0, "in_flight": 0}
+        self._payload_stats = {"bytes_on_wire": 0, "bytes_decoded": 0, "decode_seconds": 0.0}
+        self._stats_lock = threading.Lock()
+        self._async_stats = {"requests": 0, "connections_created": 0, "connections_reused": 0, "in_flight": 0}
+
+    @property
+    def endpoint(self) -> str:
+        return self._endpoint or os.environ["AZURE_SEARCH_ENDPOINT"]
+
+    @property
+    def headers(self) -> dict:
+        return {'Content-Type': 'application/json',
+                'Accept-Encoding': 'gzip, deflate',
+                'api-key': self._api_key or os.environ["AZURE_SEARCH_KEY"]}
+
+    @property
+    def params(self) -> dict:
+        return {'api-version': self._api_version or os.environ['AZURE_SEARCH_API_VERSION']}
+
+    @property
+    def session(self) -> requests.Session:
+        """Keep-alive session with a bounded pool and urllib3 retries on 429/503 (POST searches are idempotent)"""
+        with self._lock:
+            if self._session is None:
+                # Status-only retries, like _arequest: retrying timeouts would multiply the caller's timeout
+                retry = Retry(total=None, connect=0, read=0, other=0, status=self.max_retries,
+                              backoff_factor=self.backoff_factor,
+                              status_forcelist=self.RETRY_STATUSES, allowed_methods=frozenset(["GET", "POST"]),
+                              respect_retry_after_header=True, raise_on_status=False)
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=retry)
+                session = requests.Session()
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                self._session = session
+            return self._session
+
+    async def get_async_session(self) -> aiohttp.ClientSession:
+        """Returns the aiohttp session bound to the running event loop, creating it if needed"""
+        loop = asyncio.get_running_loop()
+        if self._async_session is None or self._async_session.closed or self._async_loop is not loop:
+            await self._release_async_session()
+            trace_config = aiohttp.TraceConfig()
+            trace_config.on_connection_create_end.append(self._on_connection_create)
+            trace_config.on_connection_reuseconn.append(self._on_connection_reuse)
+            connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=self.keepalive_timeout)
+            self._async_session = aiohttp.ClientSession(connector=connector, trace_configs=[trace_config])
+            self._async_loop = loop
+        return self._async_session
+
+    async def _release_async_session(self) -> None:
+        """Closes the session of a previous event loop so its pooled connections aren't leaked"""
+        session, loop = self._async_session, self._async_loop
+        self._async_session = None
+        if session is None or session.closed:
+            return
+        try:
+            if loop.is_running():
+                # Still serving another thread: close it on its own loop
+                await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(session.close(), loop))
+            else:
+                # Once the loop is closed (e.g. after asyncio.run) this only releases the connector
+                await session.close()
+        except Exception as e:
+            logger.warning(f"Failed to close the previous aiohttp session: {e}")
+
+    async def _on_connection_create(self, session, context, params):
+        self._async_stats["connections_created"] += 1
+
+    async def _on_connection_reuse(self, session, context, params):
+        self._async_stats["connections_reused"] += 1
+
+    def _search_url(self, index: str) -> str:
+        return self.endpoint + "/indexes/" + index + "/docs/search"
+
+    def _lookup_url(self, index: str, key: str) -> str:
+        return self.endpoint + "/indexes/" + index + "/docs/" + urllib.parse.quote(key, safe="")
+
+    def _decode(self, body: bytes, content_length: Optional[str]) -> dict:
+        """Decodes a JSON response body and records its size and decode time"""
+        start = time.perf_counter()
+        data = _json_loads(body)
+        elapsed = time.perf_counter() - start
+        with self._stats_lock:
+            # Content-Length is the (possibly gzip-compressed) size on the wire
+            self._payload_stats["bytes_on_wire"] += int(content_length) if content_length else len(body)
+            self._payload_stats["bytes_decoded"] += len(body)
+            self._payload_stats["decode_seconds"] += elapsed
+        return data
+
+    def _request(self, method: str, url: str, timeout: float, payload: Optional[dict] = None, params: Optional[dict] = None) -> dict:
+        with self._stats_lock:
+            self._sync_stats["requests"] += 1
+            self._sync_stats["in_flight"] += 1
+        try:
+            resp = self.session.request(method, url, data=json.dumps(payload) if payload is not None else None,
+                                        headers=self.headers, params={**self.params, **(params or {})}, timeout=timeout)
+            return self._decode(resp.content, resp.headers.get("Content-Length"))
+        finally:
+            with self._stats_lock:
+                self._sync_stats["in_flight"] -= 1
+
+    async def _arequest(self, method: str, url: str, timeout: float, payload: Optional[dict] = None, params: Optional[dict] = None,
+                        max_retries: Optional[int] = None, raise_on_throttle: bool = False) -> dict:
+        session = await self.get_async_session()
+        max_retries = self.max_retries if max_retries is None else max_retries
+        self._async_stats["requests"] += 1
+        self._async_stats["in_flight"] += 1
+        try:
+            for attempt in range(max_retries + 1):
+                async with session.request(method, url, json=payload, headers=self.headers, params={**self.params, **(params or {})},
+                                           timeout=aiohttp.ClientTimeout(total=timeout)) as resp:
+                    retry_after = resp.headers.get("Retry-After")
+                    retry_after = float(retry_after) if retry_after and retry_after.isdigit() else None
+                    if resp.status in self.RETRY_STATUSES and attempt < max_retries:
+                        wait_time = retry_after if retry_after is not None else self.backoff_factor * 2 ** attempt
+                        logger.warning(f"Retrying request to {url} in {wait_time} seconds due to status {resp.status}")
+                    elif resp.status in self.RETRY_STATUSES and raise_on_throttle:
+                        raise ThrottledError(resp.status, retry_after)
+                    else:
+                        return self._decode(await resp.read(), resp.headers.get("Content-Length"))
+                await asyncio.sleep(wait_time)
+        finally:
+            self._async_stats["in_flight"] -= 1
+
+    def search(self, index: str, payload: dict, timeout: float = 30) -> dict:
+        """Runs a search request against one index"""
+        return self._request("POST", self._search_url(index), timeout, payload=payload)
+
+    async def asearch(self, index: str, payload: dict, timeout: float = 30) -> dict:
+        """Runs a search request against one index asynchronously, retrying on 429/503"""
+        return await self._arequest("POST", self._search_url(index), timeout, payload=payload)
+
+    def lookup(self, index: str, key: str, select: str = "chunk", timeout: float = 30) -> dict:
+        """Fetches the selected fields of one document by key"""
+        return self._request("GET", self._lookup_url(index, key), timeout, params={"$select": select})
+
+    async def alookup(self, index: str, key: str, select: str = "chunk", timeout: float = 30) -> dict:
+        return await self._arequest("GET", self._lookup_url(index, key), timeout, params={"$select": select})
+
+    def _index_url(self, index: str) -> str:
+        return self.endpoint + "/indexes/" + index + "/docs/index"
+
+    def index_documents(self, index: str, actions: List[dict], timeout: float = 60) -> dict:
+        """Sends a batch of upload/merge/delete actions; the response has a per-document status in "value" """
+        return self._request("POST", self._index_url(index), timeout, payload={"value": actions})
+
+    async def aindex_documents(self, index: str, actions: List[dict], timeout: float = 60,
+                               max_retries: Optional[int] = None, raise_on_throttle: bool = False) -> dict:
+        """Async index_documents. With raise_on_throttle, a 429/503 left after max_retries raises ThrottledError
+        so the caller can back off and resize its batches instead of getting the error body back."""
+        return await self._arequest("POST", self._index_url(index), timeout, payload={"value": actions},
+                                    max_retries=max_retries, raise_on_throttle=raise_on_throttle)
+
+    def stats(self) -> dict:
+        """Returns pool occupancy and connection reuse metrics for the sync and async sessions"""
+        connections, pool_requests, idle = 0, 0, 0
+        if self._session is not None:
+            for adapter in set(self._session.adapters.values()):
+                for key in adapter.poolmanager.pools.keys():
+                    pool = adapter.poolmanager.pools[key]
+                    connections += pool.num_connections
+                    pool_requests += pool.num_requests
+                    idle += sum(1 for conn in list(pool.pool.queue) if conn is not None)
+        async_stats = dict(self._async_stats)
+        async_connections = async_stats["connections_created"] + async_stats["connections_reused"]
+        return {
+            "pool_size": self.pool_size,
+            "sync": {
+                **self._sync_stats,
+                "connections_created": connections,
+                "idle_connections": idle,
+                "pool_occupancy": self._sync_stats["in_flight"] / self.pool_size,
+                "reuse_rate": 1 - connections / pool_requests if pool_requests else 0.0,
+            },
+            "async": {
+                **async_stats,
+                "pool_occupancy": async_stats["in_flight"] / self.pool_size,
+                "reuse_rate": async_stats["connections_reused"] / async_connections if async_connections else 0.0,
+            },
+            "payload": dict(self._payload_stats),
+        }
+
+    def close(self) -> None:
+        """Closes the sync session. Call aclose() from the event loop to close the async one."""
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+    async def aclose(self) -> None:
+        if self._async_session is not None and not self._async_session.closed:
+            await self._async_session.close()
+        self._async_session = None
+        self.close()
+
+
+_default_search_client = None
+
+def get_default_search_client() -> AzureSearchClient:
+    """Returns the process-wide AzureSearchClient used when callers don't pass their own"""
+    global _default_search_client
+    if _default_search_client is None:
+        _default_search_client = AzureSearchClient()
+    return _default_search_client
+
+
+def _build_search_payload(query: str, k: int, search_filter: str = "", lean: bool = False, count: bool = False) -> dict:
+    """Builds the hybrid (semantic + vector) search payload sent to every index.
+    In lean mode the chunk text and extractive answers are left out; the final top k chunks are hydrated afterwards."""
+    search_payload = {
+        "search": query,
+        "select": "id, title, name, location" if lean else "id, title, chunk, name, location",
+        "queryType": "semantic",
+        "vectorQueries": [{"text": query, "fields": "chunkVector", "kind": "text", "k": k}],
+        "semanticConfiguration": "my-semantic-config",
+        "captions": "extractive",
+        "top": k    
+    }
+    
+    if not lean:
+        search_payload["answers"] = "extractive"
+    if count:
+        search_payload["count"] = "true"
+    if search_filter:
+        search_payload["filter"] = search_filter
+
+    return search_payload
+
+
+MERGE_STRATEGIES = ("raw", "rrf", "minmax", "zscore")
+
+def _merge_scores(scores: np.ndarray, ranks: np.ndarray, strategy: str = "raw", rrf_k: int = 60) -> np.ndarray:
+    """Vectorized per-index score transform used to make scores comparable across indexes.
+    raw: reranker score as is; rrf: 1/(rrf_k + rank); minmax / zscore: per-index normalization of the reranker scores"""
+    if strategy == "raw":
+        return scores
+    if strategy == "rrf":
+        return 1.0 / (rrf_k + ranks)
+    if strategy == "minmax":
+        spread = scores.max() - scores.min() if scores.size else 0
+        return (scores - scores.min()) / spread if spread > 0 else np.ones_like(scores)
+    if strategy == "zscore":
+        std = scores.std() if scores.size else 0
+        return (scores - scores.mean()) / std if std > 0 else np.zeros_like(scores)
+    raise ValueError(f"Unknown merge strategy '{strategy}'. Use one of {MERGE_STRATEGIES}")
+
+
+class _TopKMerger:
+    """Streaming merge of per-index search responses.
+    Keeps the k best results seen so far in a bounded min-heap, dedupes by document id keeping the max score
+    (RRF sums the contributions instead), and skips results that can't beat the current kth score before
+    building their output entry. The ranking score depends on the merge strategy (see _merge_scores);
+    the "score" field of each result is always the raw reranker score."""
+
+    def __init__(self, k: int, reranker_threshold: float, sas_token: str = "", strategy: str = "raw", rrf_k: int = 60):
+        if strategy not in MERGE_STRATEGIES:
+            raise ValueError(f"Unknown merge strategy '{strategy}'. Use one of {MERGE_STRATEGIES}")
+        self.k = k
+        self.reranker_threshold = reranker_threshold
+        self.sas_token = sas_token
+        self.strategy = strategy
+        self.rrf_k = rrf_k
+        self.received_results = False
+        self._heap = []     # (merge score, order, id); the kth best result sits at _heap[0]
+        self._entries = {}  # id -> (heap item, content)
+        self._rrf_totals = {}  # id -> accumulated RRF score across indexes
+
+    def push(self, index: str, index_position: int, search_results: dict) -> None:
+        """Merges one index response. index_position keeps ties ordered by the index list, not by arrival."""
+        if "value" not in search_results:
+            return
+        self.received_results = True
+        heap, entries = self._heap, self._entries
+        
+        # Show results that are at least N% of the max possible score=4
+        candidates = [(rank, result) for rank, result in enumerate(search_results['value'])
+                      if result['@search.rerankerScore'] > self.reranker_threshold]
+        if not candidates:
+            return
+        scores = np.fromiter((result['@search.rerankerScore'] for _, result in candidates), dtype=np.float64, count=len(candidates))
+        ranks = np.fromiter((rank + 1 for rank, _ in candidates), dtype=np.float64, count=len(candidates))
+        merge_scores = _merge_scores(scores, ranks, self.strategy, self.rrf_k).tolist()
+        
+        for (rank, result), score, merge_score in zip(candidates, scores.tolist(), merge_scores):
+            if self.strategy == "rrf":
+                merge_score = self._rrf_totals[result['id']] = self._rrf_totals.get(result['id'], 0.0) + merge_score
+            item = (merge_score, (-index_position, -rank), result['id'])
+            if len(heap) >= self.k and item <= heap[0]:
+                continue
+            
+            existing = entries.get(result['id'])
+            if existing is not None:
+                if item <= existing[0]:
+                    continue
+                heap[heap.index(existing[0])] = item
+                heapq.heapify(heap)
+            elif len(heap) < self.k:
+                heapq.heappush(heap, item)
+            else:
+                evicted = heapq.heapreplace(heap, item)
+                del entries[evicted[2]]
+            
+            entries[result['id']] = (item, {
                                         "title": result['title'], 
                                         "name": result['name'], 
-                                        "chunk": result['chunk'],
-                                        "location": result['location'] + sas_token if result['location'] else "",
+                                        "chunk": result.get('chunk'),
+                                        "location": result['location'] + self.sas_token if result['location'] else "",
                                         "caption": result['@search.captions'][0]['text'],
-                                        "score": result['@search.rerankerScore'],
+                                        "score": score,
+                                        "merge_score": merge_score,
                                         "index": index
-                                    }
-                
+                                    })
 
-    topk = k
+    def results(self) -> OrderedDict:
+        if not self.received_results:
+            logger.warning("Empty Search Response")
+            return {}
         
-    count = 0  # To keep track of the number of results added
-    for id in sorted(content, key=lambda x: content[x]["score"], reverse=True):
-        ordered_content[id] = content[id]
-        count += 1
-        if count >= topk:  # Stop after adding topK results
-            break
+        ordered_content = OrderedDict()
+        for score, order, id in sorted(self._heap, reverse=True):
+            ordered_content[id] = self._entries[id][1]
+        return ordered_content
+
+
+def _merge_responses(responses: Dict[str, dict], k: int, reranker_threshold: float, strategy: str, fetch_size: Optional[int] = None) -> OrderedDict:
+    merger = _TopKMerger(k, reranker_threshold, strategy=strategy)
+    for position, (index, search_results) in enumerate(responses.items()):
+        if fetch_size is not None and "value" in search_results:
+            search_results = {**search_results, "value": search_results["value"][:fetch_size]}
+        merger.push(index, position, search_results)
+    return merger.results()
+
+
+def evaluate_merge_strategies(recorded_responses: List[Dict[str, dict]], k: int = 5,
+                              fetch_sizes: Sequence[int] = (5, 10, 20, 50),
+                              strategies: Sequence[str] = MERGE_STRATEGIES,
+                              reranker_threshold: float = 1,
+                              reference_strategy: Optional[str] = None,
+                              relevant_ids: Optional[List[Sequence[str]]] = None) -> Dict[str, Dict[int, float]]:
+    """Offline evaluation harness for the merge strategies.
+    recorded_responses holds one {index: search response} dict per query, recorded at the largest fetch size
+    (for example with AzureSearchClient.search). Every response is truncated to each fetch size and merged with each
+    strategy, and recall@k is measured against:
+      - relevant_ids, if given: the labelled relevant document ids of each query
+      - otherwise reference_strategy's top k over the full recorded responses, if given
+      - otherwise each strategy's own top k over the full recorded responses, which isolates what is lost by
+        fetching fewer results and tells how low the fetch size can go for each strategy
+    Returns {strategy: {fetch_size: mean recall@k}}."""
+    
+    def references_for(strategy: str) -> List[set]:
+        if relevant_ids is not None:
+            return [set(ids) for ids in relevant_ids]
+        return [set(_merge_responses(responses, k, reranker_threshold, reference_strategy or strategy))
+                for responses in recorded_responses]
+    
+    report = {}
+    for strategy in strategies:
+        references = references_for(strategy)
+        report[strategy] = {}
+        for fetch_size in fetch_sizes:
+            recalls = []
+            for responses, reference in zip(recorded_responses, references):
+                if not reference:
+                    continue
+                merged = _merge_responses(responses, k, reranker_threshold, strategy, fetch_size)
+                recalls.append(len(reference.intersection(merged)) / len(reference))
+            report[strategy][fetch_size] = float(np.mean(recalls)) if recalls else 0.0
+    return report
+
+
+def _hydrate_chunks(ordered_content: OrderedDict, client: AzureSearchClient, timeout: float = 30) -> OrderedDict:
+    """Second pass of the lean retrieval mode: fetches the chunk text of the final top k results by key"""
+    if not ordered_content:
+        return ordered_content
+    with ThreadPoolExecutor(max_workers=min(len(ordered_content), client.pool_size)) as executor:
+        futures = {executor.submit(client.lookup, value["index"], id, "chunk", timeout): id for id, value in ordered_content.items()}
+        for future in as_completed(futures):
+            id = futures[future]
+            try:
+                ordered_content[id]["chunk"] = future.result().get("chunk")
+            except requests.exceptions.RequestException as e:
+                logger.warning(f"Lookup of document '{id}' failed: {e}")
+    return ordered_content
+
+
+async def _ahydrate_chunks(ordered_content: OrderedDict, client: AzureSearchClient, timeout: float = 30) -> OrderedDict:
+    """Async version of _hydrate_chunks"""
+    async def hydrate(id, value):
+        try:
+            value["chunk"] = (await client.alookup(value["index"], id, "chunk", timeout=timeout)).get("chunk")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.warning(f"Lookup of document '{id}' failed: {e!r}")
+
+    await asyncio.gather(*[hydrate(id, value) for id, value in ordered_content.items()])
+    return ordered_content
+
+
+def get_search_results(query: str, indexes: list, 
+                       search_filter: str = "",
+                       k: int = 5,
+                       reranker_threshold: float = 1,
+                       sas_token: str = "",
+                       timeout: float = 30,
+                       client: Optional[AzureSearchClient] = None,
+                       cache: Optional[SearchResultCache] = None,
+                       semantic_cache: Optional[SemanticQueryCache] = None,
+                       merge_strategy: str = "raw",
+                       fetch_k: Optional[int] = None,
+                       lean: bool = False) -> List[dict]:
+    """Performs multi-index hybrid search and returns ordered dictionary with the combined results.
+    All the indexes are queried concurrently, so latency tracks the slowest index instead of the sum of all of them.
+    If a cache (exact match) and/or a semantic_cache (paraphrase match) is given, results are served from / stored in them.
+    merge_strategy (raw, rrf, minmax, zscore) controls how scores are compared across indexes, and fetch_k sets how
+    many results are requested per index (defaults to k). With lean=True the first pass only fetches ids, scores and
+    captions, and the chunk text is looked up by key for the final top k only."""
+    
+    cache_params = dict(k=k, search_filter=search_filter, reranker_threshold=reranker_threshold, sas_token=sas_token,
+                        merge_strategy=merge_strategy, fetch_k=fetch_k)
+    if cache is not None:
+        cache_key = cache.make_key(query, indexes, **cache_params)
+        cached_results = cache.get(cache_key)
+        if cached_results is not None:
+            return cached_results
+    if semantic_cache is not None:
+        scope = semantic_cache.make_scope(indexes=sorted(indexes), **cache_params)
+        cached_results, query_vector = semantic_cache.lookup(query, scope)
+        if cached_results is not None:
+            return cached_results
+
+    client = client or get_default_search_client()
+    search_payload = _build_search_payload(query, fetch_k or k, search_filter, lean=lean)
+
+    merger = _TopKMerger(k, reranker_threshold, sas_token, strategy=merge_strategy)
+    
+    with ThreadPoolExecutor(max_workers=max(len(indexes), 1)) as executor:
+        futures = {executor.submit(client.search, index, search_payload, timeout): (position, index)
+                   for position, index in enumerate(indexes)}
+        for future in as_completed(futures):
+            position, index = futures[future]
+            try:
+                merger.push(index, position, future.result())
+            except requests.exceptions.RequestException as e:
+                logger.warning(f"Search on index '{index}' failed: {e}")
+        
+    ordered_content = merger.results()
+    if lean:
+        ordered_content = _hydrate_chunks(ordered_content, client, timeout)
+    if cache is not None and ordered_content:
+        cache.set(cache_key, ordered_content)
+    if semantic_cache is not None and ordered_content:
+        semantic_cache.add(query_vector, ordered_content, scope)
 
     return ordered_content
 
 
+async def aget_search_results(query: str, indexes: list, 
+                              search_filter: str = "",
+                              k: int = 5,
+                              reranker_threshold: float = 1,
+                              sas_token: str = "",
+                              timeout: float = 30,
+                              client: Optional[AzureSearchClient] = None,
+                              cache: Optional[SearchResultCache] = None,
+                              semantic_cache: Optional[SemanticQueryCache] = None,
+                              merge_strategy: str = "raw",
+                              fetch_k: Optional[int] = None,
+                              lean: bool = False) -> List[dict]:
+    """Async version of get_search_results. Sends all the index queries at once over the client's pooled
+    aiohttp session, with a per-index timeout, and collects the responses as they arrive"""
+    
+    cache_params = dict(k=k, search_filter=search_filter, reranker_threshold=reranker_threshold, sas_token=sas_token,
+                        merge_strategy=merge_strategy, fetch_k=fetch_k)
+    if cache is not None:
+        cache_key = cache.make_key(query, indexes, **cache_params)
+        cached_results = cache.get(cache_key)
+        if cached_results is not None:
+            return cached_results
+    if semantic_cache is not None:
+        scope = semantic_cache.make_scope(indexes=sorted(indexes), **cache_params)
+        cached_results, query_vector = await semantic_cache.alookup(query, scope)
+        if cached_results is not None:
+            return cached_results
+
+    client = client or get_default_search_client()
+    search_payload = _build_search_payload(query, fetch_k or k, search_filter, lean=lean)
+
+    async def search_index(position, index):
+        try:
+            return position, index, await client.asearch(index, search_payload, timeout=timeout)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.warning(f"Search on index '{index}' failed: {e!r}")
+            return position, index, None
+
+    merger = _TopKMerger(k, reranker_threshold, sas_token, strategy=merge_strategy)
+    
+    for next_result in asyncio.as_completed([search_index(position, index) for position, index in enumerate(indexes)]):
+        position, index, search_results = await next_result
+        if search_results is not None:
+            merger.push(index, position, search_results)
+        
+    ordered_content = merger.results()
+    if lean:
+        ordered_content = await _ahydrate_chunks(ordered_content, client, timeout)
+    if cache is not None and ordered_content:
+        cache.set(cache_key, ordered_content)
+    if semantic_cache is not None and ordered_content:
+        semantic_cache.add(query_vector, ordered_content, scope)
+
+    return ordered_content
+
+
+
+def _shingles(text: str, size: int = 5) -> set:
+    """Hashed word shingles used to detect near-duplicate chunks"""
+    words = text.lower().split()
+    if len(words) <= size:
+        return {hash(tuple(words))}
+    return {hash(tuple(words[i:i + size])) for i in range(len(words) - size + 1)}
+
+
+def pack_context(docs: List[dict], max_tokens: int = 6000, min_chunk_tokens: int = 50,
+                 dedupe_threshold: float = 0.9, model: Optional[str] = None) -> Tuple[str, dict]:
+    """Packs retrieved documents ({"source", "score", "page_content"}) into a compact text context.
+    Documents are added greedily in score order until max_tokens is reached; a document that doesn't fit is
+    truncated if at least min_chunk_tokens remain, otherwise skipped. Near-duplicate chunks (shingle Jaccard
+    similarity >= dedupe_threshold) are dropped. Returns the context text and a stats dict with the tokens saved."""
+    
+    encoding = get_token_encoder(model)
+    stats = {"docs_in": len(docs), "docs_packed": 0, "docs_truncated": 0, "docs_skipped": 0, "duplicates": 0}
+    
+    parts = []
+    kept_shingles = []
+    used_tokens = 0
+    ranked_docs = sorted(docs, key=lambda d: d["score"], reverse=True)
+    ranked_tokens = encoding.encode_ordinary_batch([doc["page_content"] or "" for doc in ranked_docs])
+    for position, (doc, content_tokens) in enumerate(zip(ranked_docs, ranked_tokens)):
+        if max_tokens - used_tokens < min_chunk_tokens:
+            stats["docs_skipped"] += len(ranked_docs) - position
+            break
+        content = doc["page_content"] or ""
+        shingles = _shingles(content)
+        if any(len(shingles & kept) / len(shingles | kept) >= dedupe_threshold for kept in kept_shingles):
+            stats["duplicates"] += 1
+            continue
+        
+        header = f"[{stats['docs_packed'] + 1}] source: {doc['source']}\nscore: {round(doc['score'], 2)}\n"
+        header_tokens = len(encoding.encode_ordinary(header))
+        remaining = max_tokens - used_tokens - header_tokens
+        if len(content_tokens) > remaining:
+            if remaining < min_chunk_tokens:
+                stats["docs_skipped"] += 1
+                continue
+            content_tokens = content_tokens[:remaining]
+            content = encoding.decode(content_tokens)
+            stats["docs_truncated"] += 1
+        
+        parts.append(header + content)
+        kept_shingles.append(shingles)
+        used_tokens += header_tokens + len(content_tokens)
+        stats["docs_packed"] += 1
+    
+    context = "\n\n".join(parts)
+    stats["tokens_in"] = sum(len(tokens) for tokens in ranked_tokens)
+    stats["tokens_out"] = len(encoding.encode_ordinary(context))
+    stats["tokens_saved"] = stats["tokens_in"] - stats["tokens_out"]
+    return context, stats
+
 
 class CustomAzureSearchRetriever(BaseRetriever):
     
@@ -349,14 +1355,38 @@ class CustomAzureSearchRetriever(BaseRetriever):
     reranker_threshold : float
     sas_token : str = ""
     search_filter : str = ""
+    search_client : AzureSearchClient = Field(default_factory=AzureSearchClient)
+    cache : Optional[SearchResultCache] = None
+    semantic_cache : Optional[SemanticQueryCache] = None
+    merge_strategy : str = "raw"
+    fetch_k : Optional[int] = None
+    lean : bool = False
     
     
     def _get_relevant_documents(
         self, input: str, *, run_manager: CallbackManagerForRetrieverRun
     ) -> List[dict]:
         
-        ordered_results = get_search_results(input, self.indexes, k=self.topK, reranker_threshold=self.reranker_threshold, sas_token=self.sas_token, search_filter=self.search_filter)
+        ordered_results = get_search_results(input, self.indexes, k=self.topK, reranker_threshold=self.reranker_threshold, sas_token=self.sas_token, search_filter=self.search_filter,
+                                             client=self.search_client, cache=self.cache,
+                                             semantic_cache=self.semantic_cache, merge_strategy=self.merge_strategy,
+                                             fetch_k=self.fetch_k, lean=self.lean)
         
+        return self._to_documents(ordered_results)
+
+    async def _aget_relevant_documents(
+        self, input: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> List[dict]:
+        
+        ordered_results = await aget_search_results(input, self.indexes, k=self.topK, reranker_threshold=self.reranker_threshold, sas_token=self.sas_token, search_filter=self.search_filter,
+                                                    client=self.search_client, cache=self.cache,
+                                                    semantic_cache=self.semantic_cache, merge_strategy=self.merge_strategy,
+                                                    fetch_k=self.fetch_k, lean=self.lean)
+        
+        return self._to_documents(ordered_results)
+
+    @staticmethod
+    def _to_documents(ordered_results) -> List[dict]:
         top_docs = []
         for key,value in ordered_results.items():
             location = value["location"] if value["location"] is not None else ""
@@ -371,9 +1401,20 @@ class CustomAzureSearchRetriever(BaseRetriever):
 def get_answer(llm: AzureChatOpenAI,
                retriever: CustomAzureSearchRetriever, 
                query: str,
+               semantic_cache: Optional[SemanticQueryCache] = None,
                ) -> Dict[str, Any]:
     
-    """Gets an answer to a question from a list of Documents."""
+    """Gets an answer to a question from a list of Documents.
+    If a semantic_cache is given, answers to previous paraphrases of the question are reused."""
+
+    if semantic_cache is not None:
+        scope = semantic_cache.make_scope(kind="answer", indexes=sorted(retriever.indexes), k=retriever.topK,
+                                          reranker_threshold=retriever.reranker_threshold,
+                                          search_filter=retriever.search_filter, sas_token=retriever.sas_token,
+                                          merge_strategy=retriever.merge_strategy, fetch_k=retriever.fetch_k)
+        cached_answer, query_vector = semantic_cache.lookup(query, scope)
+        if cached_answer is not None:
+            return cached_answer
 
     # Get the answer
     
@@ -387,7 +1428,7 @@ def get_answer(llm: AzureChatOpenAI,
         
     chain = (
         {
-            "context": itemgetter("question") | retriever, # Passes the question to the retriever and the results are assign to context
+            "context": itemgetter("question") | retriever | (lambda docs: pack_context(docs)[0]), # Passes the question to the retriever and packs the results into the context
             "question": itemgetter("question")
         }
         | DOCSEARCH_PROMPT  # Passes the 4 variables above to the prompt template
@@ -397,6 +1438,9 @@ def get_answer(llm: AzureChatOpenAI,
     
     answer = chain.invoke({"question": query})
 
+    if semantic_cache is not None:
+        semantic_cache.add(query_vector, answer, scope)
+
     return answer
 
     
@@ -423,41 +1467,61 @@ class GetDocSearchResults_Tool(BaseTool):
     k: int = 10
     reranker_th: float = 1
     sas_token: str = "" 
+    search_client: AzureSearchClient = Field(default_factory=AzureSearchClient)
+    cache: Optional[SearchResultCache] = None
+    semantic_cache: Optional[SemanticQueryCache] = None
+    merge_strategy: str = "raw"
+    fetch_k: Optional[int] = None
+    lean: bool = False
+    context_token_budget: Optional[int] = 6000  # None returns the raw list of documents
 
     def _run(self, query: str,  return_direct = False,  run_manager: Optional[CallbackManagerForToolRun] = None
     ) -> str:
 
         retriever = CustomAzureSearchRetriever(indexes=self.indexes, topK=self.k, reranker_threshold=self.reranker_th, 
-                                               sas_token=self.sas_token, callback_manager=self.callbacks)
+                                               sas_token=self.sas_token, search_client=self.search_client,
+                                               cache=self.cache, semantic_cache=self.semantic_cache,
+                                               merge_strategy=self.merge_strategy, fetch_k=self.fetch_k,
+                                               lean=self.lean, callback_manager=self.callbacks)
         results = retriever.invoke(input=query)
         
-        return results
+        return self._pack(results)
 
     async def _arun(self, query: str, return_direct = False, run_manager: Optional[AsyncCallbackManagerForToolRun] = None) -> str:
         """Use the tool asynchronously."""
         
         retriever = CustomAzureSearchRetriever(indexes=self.indexes, topK=self.k, reranker_threshold=self.reranker_th, 
-                                               sas_token=self.sas_token, callback_manager=self.callbacks)
-        # Please note below that running a non-async function like run_agent in a separate thread won't make it truly asynchronous. 
-        # It allows the function to be called without blocking the event loop, but it may still have synchronous behavior internally.
-        loop = asyncio.get_event_loop()
-        results = await loop.run_in_executor(ThreadPoolExecutor(), retriever.invoke, query)
+                                               sas_token=self.sas_token, search_client=self.search_client,
+                                               cache=self.cache, semantic_cache=self.semantic_cache,
+                                               merge_strategy=self.merge_strategy, fetch_k=self.fetch_k,
+                                               lean=self.lean, callback_manager=self.callbacks)
+        results = await retriever.ainvoke(query)
         
-        return results
+        return self._pack(results)
+
+    def _pack(self, results: List[dict]):
+        if self.context_token_budget is None:
+            return results
+        context, stats = pack_context(results, max_tokens=self.context_token_budget)
+        logger.info(f"documents_retrieval packed {stats['docs_packed']}/{stats['docs_in']} docs, "
+                    f"{stats['tokens_out']} tokens ({stats['tokens_saved']} saved)")
+        return context
 
 
 def create_docsearch_agent(
         llm:AzureChatOpenAI,
         indexes: List, k:int, reranker_th:float,
         prompt:str,
-        sas_token:str=""
+        sas_token:str="",
+        cache:Optional[SearchResultCache]=None
     ):
 
 
     docsearch_tool = GetDocSearchResults_Tool(indexes=indexes,
                                               k=k,
                                               reranker_th=reranker_th, 
-                                              sas_token=sas_token)
+                                              sas_token=sas_token,
+                                              cache=cache)
 
     docsearch_agent = create_react_agent(llm, tools=[docsearch_tool], state_modifier=prompt)
     
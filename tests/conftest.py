@@ -0,0 +1,135 @@
+import io
+import os
+import sys
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+# Tests import the shared code the same way the notebooks and apps do: from common.utils import ...
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+def fake_search_results(index: str, n: int = 5) -> dict:
+    """A search response in the shape returned by Azure AI Search semantic hybrid queries"""
+    return {"value": [{"id": f"{index}-{i}", "title": f"{index} doc {i}", "name": f"{index}-{i}.pdf",
+                       "chunk": f"chunk {i} of {index}", "location": "",
+                       "@search.score": 1.0, "@search.rerankerScore": 3.5 - i * 0.1,
+                       "@search.captions": [{"text": f"caption {i}"}]}
+                      for i in range(n)]}
+
+
+class SearchStub:
+    """Local stand-in for the Azure AI Search REST API (search and docs/index) with per-index latency and scripted status codes"""
+
+    def __init__(self):
+        self.delays = {}     # index -> seconds to sleep before answering
+        self.statuses = {}   # index -> list of status codes to answer with before succeeding
+        self.requests = {}   # index -> number of requests received
+        self.max_batch = {}  # index -> largest docs/index batch accepted, larger ones get a 429
+        self.documents = {}  # index -> {key: indexed document}
+        self.batches = {}    # index -> sizes of the accepted docs/index batches, in order
+        self._lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                index = self.path.split("/indexes/")[1].split("/")[0]
+                actions = payload.get("value") if "/docs/index" in self.path else None
+                with stub._lock:
+                    stub.requests[index] = stub.requests.get(index, 0) + 1
+                    scripted = stub.statuses.get(index) or []
+                    status = scripted.pop(0) if scripted else 200
+                    if status == 200 and actions is not None:
+                        if len(actions) > stub.max_batch.get(index, 1000):
+                            status = 429
+                        else:
+                            stub.documents.setdefault(index, {}).update((action["id"], action) for action in actions)
+                            stub.batches.setdefault(index, []).append(len(actions))
+                time.sleep(stub.delays.get(index, 0))
+                if status != 200:
+                    result = {"error": {"code": str(status)}}
+                elif actions is not None:
+                    result = {"value": [{"key": action["id"], "status": True, "statusCode": 201} for action in actions]}
+                else:
+                    result = fake_search_results(index)
+                body = json.dumps(result).encode()
+                try:
+                    self.send_response(status)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(body)))
+                    if status != 200:
+                        self.send_header("Retry-After", "0")
+                    self.end_headers()
+                    self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # the client gave up (timeout)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.endpoint = f"http://127.0.0.1:{self.server.server_port}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def search_stub():
+    stub = SearchStub()
+    yield stub
+    stub.close()
+
+
+@pytest.fixture
+def search_client(search_stub):
+    from common.utils import AzureSearchClient
+    client = AzureSearchClient(endpoint=search_stub.endpoint, api_key="test-key", api_version="2024-07-01",
+                               backoff_factor=0)
+    yield client
+    client.close()
+
+
+def make_pdf(pages: int, lines_per_page: int = 20) -> bytes:
+    """A minimal PDF whose pages hold distinct lines of Helvetica text, so PyPDF extracts different text per page"""
+    objects = [b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>", b""]  # 1: font, 2: page tree (filled below)
+    kids = []
+    for page in range(pages):
+        lines = " ".join(f"(Page {page} line {line} lorem ipsum dolor sit amet) Tj 0 -12 Td" for line in range(lines_per_page))
+        stream = f"BT /F1 9 Tf 20 800 Td {lines} ET".encode()
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] /Contents %d 0 R "
+                       b"/Resources << /Font << /F1 1 0 R >> >> >>" % len(objects))
+        kids.append(len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(b"%d 0 R" % kid for kid in kids), pages)
+    objects.append(b"<< /Type /Catalog /Pages 2 0 R >>")
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, len(objects), xref)
+    return bytes(out)
+
+
+class NamedBytesIO(io.BytesIO):
+    """In-memory upload with a name, like Streamlit's UploadedFile"""
+
+    def __init__(self, data: bytes, name: str):
+        super().__init__(data)
+        self.name = name
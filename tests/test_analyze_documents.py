@@ -0,0 +1,127 @@
+import json
+import time
+import threading
+
+import pytest
+from azure.ai.formrecognizer import DocumentAnalysisClient
+from azure.core.credentials import AzureKeyCredential
+from azure.core.exceptions import HttpResponseError
+from azure.core.pipeline.transport import HttpTransport, HttpResponse
+from azure.core.utils import CaseInsensitiveDict
+
+from common.utils import analyze_documents
+
+ENDPOINT = "https://fake.cognitiveservices.azure.com/"
+
+
+class _Response(HttpResponse):
+    def __init__(self, request, status_code, body, headers=None):
+        super().__init__(request, None)
+        self.status_code = status_code
+        self.reason = "OK"
+        self.headers = CaseInsensitiveDict(headers or {})
+        self.content_type = "application/json"
+        self._body = json.dumps(body).encode()
+
+    def body(self):
+        return self._body
+
+
+class FakeDocumentIntelligence(HttpTransport):
+    """Local stand-in for the analyze REST API: each document (its bytes are its name) stays "running" for its own
+    delay after submission, then succeeds with one page of text, or fails if its name is in failing"""
+
+    def __init__(self, delays, failing=()):
+        self.delays = delays
+        self.failing = set(failing)
+        self.submitted = {}  # name -> submission time
+        self.polls = {}      # name -> status poll times
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+    def send(self, request, **kwargs):
+        with self._lock:
+            if request.method == "POST":
+                name = request.body.decode()
+                self.submitted[name] = time.monotonic()
+                self.polls[name] = []
+                self.in_flight += 1
+                self.max_in_flight = max(self.max_in_flight, self.in_flight)
+                location = f"{ENDPOINT}formrecognizer/documentModels/prebuilt-document/analyzeResults/{name}?api-version=2023-07-31"
+                return _Response(request, 202, {}, {"Operation-Location": location})
+
+            name = request.url.split("/analyzeResults/")[1].split("?")[0]
+            now = time.monotonic()
+            self.polls[name].append(now)
+            if now - self.submitted[name] < self.delays[name]:
+                return _Response(request, 200, {"status": "running"})
+            self.in_flight -= 1
+        if name in self.failing:
+            return _Response(request, 200, {"status": "failed", "error": {"code": "InvalidContent", "message": "Corrupt document"}})
+        content = f"text of {name}"
+        return _Response(request, 200, {
+            "status": "succeeded", "createdDateTime": "2024-01-01T00:00:00Z", "lastUpdatedDateTime": "2024-01-01T00:00:00Z",
+            "analyzeResult": {"apiVersion": "2023-07-31", "modelId": "prebuilt-document", "content": content, "tables": [],
+                              "pages": [{"pageNumber": 1, "spans": [{"offset": 0, "length": len(content)}], "words": [], "lines": []}]}})
+
+
+def _client(transport):
+    return DocumentAnalysisClient(ENDPOINT, AzureKeyCredential("test-key"), transport=transport)
+
+
+def test_bounded_concurrency_yields_in_completion_order():
+    delays = {"doc-0": 0.6, "doc-1": 0.1, "doc-2": 0.4, "doc-3": 0.2, "doc-4": 0.5, "doc-5": 0.1}
+    service = FakeDocumentIntelligence(delays)
+    files = [name.encode() for name in delays]
+
+    start = time.monotonic()
+    results = list(analyze_documents(files, max_concurrency=3, poll_interval=0.02, max_poll_interval=0.05,
+                                     client=_client(service)))
+    elapsed = time.monotonic() - start
+
+    assert sorted(file for file, _ in results) == sorted(files)
+    for file, page_map in results:
+        assert page_map == [(0, 0, f"text of {file.decode()} ")]
+    # Short analyses finish (and are handed over) before the long first one
+    assert results[0][0] != b"doc-0"
+    assert service.max_in_flight == 3
+    # Three at a time overlap the service latency: well under the 1.9 s it takes one by one
+    assert elapsed < sum(delays.values()) * 0.6
+
+
+def test_rate_limit_spaces_submissions():
+    service = FakeDocumentIntelligence({f"doc-{i}": 0.0 for i in range(5)})
+    list(analyze_documents([f"doc-{i}".encode() for i in range(5)], max_concurrency=5, rate_limit=10,
+                           poll_interval=0.01, client=_client(service)))
+    submissions = sorted(service.submitted.values())
+    assert all(later - earlier >= 0.09 for earlier, later in zip(submissions, submissions[1:]))
+
+
+def test_status_polls_back_off():
+    service = FakeDocumentIntelligence({"doc-0": 1.0})
+    list(analyze_documents([b"doc-0"], poll_interval=0.05, max_poll_interval=0.2, client=_client(service)))
+    polls = service.polls["doc-0"]
+    gaps = [later - earlier for earlier, later in zip(polls, polls[1:])]
+    # Doubling from 0.05 s up to 0.2 s: a handful of polls instead of one every 0.05 s
+    assert len(polls) <= 8
+    assert all(later >= earlier * 0.9 for earlier, later in zip(gaps, gaps[1:]))
+    assert max(gaps) < 0.3
+
+
+def test_failed_analysis_raises():
+    service = FakeDocumentIntelligence({"doc-0": 0.0, "bad": 0.05}, failing={"bad"})
+    with pytest.raises(HttpResponseError):
+        list(analyze_documents([b"doc-0", b"bad"], poll_interval=0.01, client=_client(service)))
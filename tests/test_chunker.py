@@ -0,0 +1,53 @@
+import base64
+import random
+
+import pytest
+
+from common.ingestion import TokenChunker
+from common.utils import get_token_encoder
+
+
+@pytest.fixture(scope="module", autouse=True)
+def encoder():
+    # tiktoken downloads its encodings on first use
+    try:
+        return get_token_encoder()
+    except Exception as e:
+        pytest.skip(f"tiktoken encoding not available: {e}")
+
+
+def _check_chunks(chunks, text, target):
+    assert chunks
+    for chunk in chunks:
+        assert chunk["tokens"] <= target
+        # Provenance points back at the exact source text
+        assert text[chunk["offset"]:chunk["offset"] + chunk["length"]] == chunk["text"]
+    assert chunks[0]["offset"] == 0
+    assert chunks[-1]["offset"] + chunks[-1]["length"] == len(text)
+
+
+@pytest.mark.parametrize("text", [
+    "这是一个没有空格的很长的中文句子" * 400,
+    "https://example.com/" + "/".join(f"segment{i}" for i in range(1500)),
+    base64.b64encode(random.Random(0).randbytes(12000)).decode(),
+], ids=["cjk", "url", "base64"])
+def test_splits_text_without_whitespace(text):
+    chunker = TokenChunker(target_tokens=200, overlap_tokens=20)
+    chunks = chunker.split([(0, 0, text)])
+    assert len(chunks) > 1
+    _check_chunks(chunks, text, 200)
+
+
+def test_splits_long_sentences_at_whitespace():
+    text = " ".join(f"word{i}" for i in range(3000))
+    chunks = TokenChunker(target_tokens=200, overlap_tokens=0).split([(0, 0, text)])
+    _check_chunks(chunks, text, 200)
+    # Cuts land right after a space, so no word is split
+    assert all(chunk["text"].endswith(" ") for chunk in chunks[:-1])
+
+
+def test_never_splits_tables():
+    table = "<table>" + "".join(f"<tr><td>cell {i}</td></tr>" for i in range(300)) + "</table>"
+    text = "Intro sentence. " + table + " Closing sentence."
+    chunks = TokenChunker(target_tokens=100, overlap_tokens=10).split([(0, 0, text)])
+    assert sum(table in chunk["text"] for chunk in chunks) == 1
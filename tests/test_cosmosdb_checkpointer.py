@@ -0,0 +1,245 @@
+import copy
+import time
+import uuid
+import asyncio
+
+import pytest
+from azure.cosmos import exceptions
+from langgraph.checkpoint.base import empty_checkpoint
+
+from common import cosmosdb_checkpointer
+from common.cosmosdb_checkpointer import CosmosDBSaver, AsyncCosmosDBSaver
+
+
+class FakeContainer:
+    """In-memory Cosmos container: upserts assign a new _etag, conditional point reads answer 304 when unchanged.
+    Every call is one round trip of latency seconds."""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.items = {}  # (partition key, id) -> doc
+        self.reads = {"full": 0, "not_modified": 0}
+        self.round_trips = 0
+
+    def _upsert(self, doc):
+        stored = dict(copy.deepcopy(doc), _etag=uuid.uuid4().hex)
+        self.items[(stored["thread_id"], stored["id"])] = stored
+        return copy.deepcopy(stored)
+
+    def _batch(self, batch_operations):
+        return [self._upsert(args[0]) for _, args in batch_operations]
+
+    def _round_trip(self):
+        self.round_trips += 1
+        time.sleep(self.latency)
+
+    def upsert_item(self, doc, **kwargs):
+        self._round_trip()
+        return self._upsert(doc)
+
+    def execute_item_batch(self, batch_operations, partition_key, **kwargs):
+        self._round_trip()
+        return self._batch(batch_operations)
+
+    def read_item(self, item, partition_key, **kwargs):
+        self._round_trip()
+        return self._read(item, partition_key, **kwargs)
+
+    def _read(self, item, partition_key, etag=None, match_condition=None, **kwargs):
+        doc = self.items.get((partition_key, item))
+        if doc is None:
+            raise exceptions.CosmosResourceNotFoundError(status_code=404, message="Not found")
+        if etag is not None and doc["_etag"] == etag:
+            self.reads["not_modified"] += 1
+            raise exceptions.CosmosHttpResponseError(status_code=304, message="Not modified")
+        self.reads["full"] += 1
+        return copy.deepcopy(doc)
+
+    def query_items(self, query, parameters=None, partition_key=None, **kwargs):
+        raise AssertionError("latest checkpoint must be found through the head pointer, not a query")
+
+
+class AsyncFakeContainer:
+    """The same container behind the async SDK's coroutine interface"""
+
+    def __init__(self, container):
+        self.container = container
+
+    async def _round_trip(self):
+        self.container.round_trips += 1
+        await asyncio.sleep(self.container.latency)
+
+    async def upsert_item(self, doc, **kwargs):
+        await self._round_trip()
+        return self.container._upsert(doc)
+
+    async def execute_item_batch(self, batch_operations, partition_key, **kwargs):
+        await self._round_trip()
+        return self.container._batch(batch_operations)
+
+    async def read_item(self, item, partition_key, **kwargs):
+        await self._round_trip()
+        return self.container._read(item, partition_key, **kwargs)
+
+    def query_items(self, query, **kwargs):
+        return self.container.query_items(query, **kwargs)
+
+
+class PerItemContainer:
+    """The container without transactional batch support, so upsert_items sends one upsert per document"""
+
+    def __init__(self, container):
+        self.container = container
+
+    def upsert_item(self, doc, **kwargs):
+        return self.container.upsert_item(doc)
+
+
+class AsyncPerItemContainer(PerItemContainer):
+    async def upsert_item(self, doc, **kwargs):
+        return await self.container.upsert_item(doc)
+
+
+class _NoClient:
+    def __init__(self, *args, **kwargs):
+        pass
+
+    async def close(self):
+        pass
+
+
+@pytest.fixture
+def container(monkeypatch):
+    # The savers never reach the SDK clients: their container is the in-memory fake
+    monkeypatch.setattr(cosmosdb_checkpointer, "CosmosClient", _NoClient)
+    monkeypatch.setattr(cosmosdb_checkpointer, "AsyncCosmosClient", _NoClient)
+    return FakeContainer()
+
+
+def _saver(cls, container, **options):
+    saver = cls(endpoint="https://localhost:8081/", key="key", database_name="db", container_name="checkpoints",
+                cache_max_bytes=1 << 20, **options)
+    saver.container = container
+    saver._initialized = True
+    return saver
+
+
+def _config(thread_id, checkpoint_id=None):
+    config = {"configurable": {"thread_id": thread_id}}
+    if checkpoint_id:
+        config["configurable"]["checkpoint_id"] = checkpoint_id
+    return config
+
+
+def _latest_id(checkpoint_tuple):
+    return checkpoint_tuple.config["configurable"]["checkpoint_id"] if checkpoint_tuple else None
+
+
+def test_replica_sees_checkpoint_written_by_another(container):
+    writer, reader = _saver(CosmosDBSaver, container), _saver(CosmosDBSaver, container)
+    first, second = empty_checkpoint(), empty_checkpoint()
+
+    writer.put(_config("t1"), first, {"step": 1}, {})
+    assert _latest_id(reader.get_tuple(_config("t1"))) == first["id"]
+
+    # Unchanged head: the reader validates its cached pointer with a 304 and serves the checkpoint from cache
+    reads = dict(container.reads)
+    assert _latest_id(reader.get_tuple(_config("t1"))) == first["id"]
+    assert container.reads["not_modified"] == reads["not_modified"] + 1
+    assert container.reads["full"] == reads["full"]
+
+    # The writer moves the head: the reader's conditional read sees the new ETag and follows it
+    writer.put(_config("t1", first["id"]), second, {"step": 2}, {})
+    latest = reader.get_tuple(_config("t1"))
+    assert _latest_id(latest) == second["id"]
+    assert latest.metadata["step"] == 2
+    assert latest.parent_config["configurable"]["checkpoint_id"] == first["id"]
+    assert reader.cache.stats()["validations"] == 1
+
+
+def test_async_replica_sees_checkpoint_written_by_another(container):
+    writer, reader = _saver(AsyncCosmosDBSaver, container), _saver(AsyncCosmosDBSaver, container)
+    for saver in (writer, reader):
+        saver.container = AsyncFakeContainer(container)
+    first, second = empty_checkpoint(), empty_checkpoint()
+
+    async def run():
+        await writer.aput(_config("t1"), first, {"step": 1}, {})
+        seen = [_latest_id(await reader.aget_tuple(_config("t1")))]
+        seen.append(_latest_id(await reader.aget_tuple(_config("t1"))))
+        await writer.aput(_config("t1", first["id"]), second, {"step": 2}, {})
+        seen.append(_latest_id(await reader.aget_tuple(_config("t1"))))
+        return seen
+
+    assert asyncio.run(run()) == [first["id"], first["id"], second["id"]]
+    assert container.reads["not_modified"] == 1
+
+
+WRITES = [(f"channel-{i}", {"value": i}) for i in range(20)]
+
+
+def test_put_writes_batch_benchmark(container):
+    container.latency = 0.005
+    timings = {}
+    for name, target in (("per item", PerItemContainer(container)), ("batch", container)):
+        saver = _saver(CosmosDBSaver, target)
+        round_trips, start = container.round_trips, time.perf_counter()
+        saver.put_writes(_config("t1", "checkpoint-1"), WRITES, f"task-{name}")
+        timings[name] = (time.perf_counter() - start, container.round_trips - round_trips)
+    print(f"\n{len(WRITES)} writes at 5 ms per round trip: "
+          + ", ".join(f"{name} {seconds * 1000:.0f} ms / {trips} round trips" for name, (seconds, trips) in timings.items()))
+    assert timings["per item"][1] == len(WRITES) and timings["batch"][1] == 1
+    assert timings["batch"][0] * 5 < timings["per item"][0]
+    assert len([key for key in container.items if key[1].startswith("checkpoint-1_task-batch")]) == len(WRITES)
+
+
+def test_async_put_writes_batch_benchmark(container):
+    container.latency = 0.005
+    timings = {}
+
+    async def run():
+        for name, target in (("per item", AsyncPerItemContainer(AsyncFakeContainer(container))),
+                             ("batch", AsyncFakeContainer(container))):
+            saver = _saver(AsyncCosmosDBSaver, target)
+            round_trips, start = container.round_trips, time.perf_counter()
+            await saver.aput_writes(_config("t1", "checkpoint-1"), WRITES, f"task-{name}")
+            timings[name] = (time.perf_counter() - start, container.round_trips - round_trips)
+
+    asyncio.run(run())
+    assert timings["per item"][1] == len(WRITES) and timings["batch"][1] == 1
+    assert timings["batch"][0] * 5 < timings["per item"][0]
+
+
+def _p99_turn_latency(saver, threads: int = 200) -> float:
+    """Runs one turn (read latest, save a checkpoint, save its writes) on each of the threads concurrently"""
+    latencies = []
+
+    async def turn(thread_id):
+        start = time.perf_counter()
+        config = _config(thread_id)
+        await saver.aget_tuple(config)
+        config = await saver.aput(config, empty_checkpoint(), {"step": 2}, {})
+        await saver.aput_writes(config, WRITES[:2], "task")
+        latencies.append(time.perf_counter() - start)
+
+    async def run():
+        # Every thread already has a head, as in a running conversation
+        for i in range(threads):
+            await saver.aput(_config(f"t{i}"), empty_checkpoint(), {"step": 1}, {})
+        saver.container.container.latency = 0.002
+        await asyncio.gather(*(turn(f"t{i}") for i in range(threads)))
+
+    asyncio.run(run())
+    return sorted(latencies)[int(len(latencies) * 0.99) - 1]
+
+
+@pytest.mark.parametrize("options", [{}, {"max_concurrency": 50, "ordered_threads": True}], ids=["unbounded", "bounded-ordered"])
+def test_concurrent_threads_p99_latency(monkeypatch, options):
+    monkeypatch.setattr(cosmosdb_checkpointer, "AsyncCosmosClient", _NoClient)
+    p99 = {}
+    # max_concurrency=1 lets one Cosmos call through at a time, like the global lock did
+    for name, saver_options in (("serialized", {"max_concurrency": 1}), ("concurrent", options)):
+        p99[name] = _p99_turn_latency(_saver(AsyncCosmosDBSaver, AsyncFakeContainer(FakeContainer()), **saver_options))
+    print(f"\np99 turn latency, 200 threads at 2 ms per round trip: "
+          + ", ".join(f"{name} {seconds * 1000:.0f} ms" for name, seconds in p99.items()))
+    assert p99["concurrent"] * 5 < p99["serialized"]
@@ -0,0 +1,75 @@
+import random
+import timeit
+from types import SimpleNamespace
+
+from common.utils import _iter_form_recognizer_pages, table_to_html
+
+
+def synthetic_result(pages: int, page_length: int = 3000, seed: int = 0) -> SimpleNamespace:
+    """An analyze result shaped like the Document Intelligence SDK's: content, pages with spans, tables with spans,
+    cells and bounding regions. Up to 3 tables per page, some split across two spans."""
+    rng = random.Random(seed)
+    content, page_objects, tables = [], [], []
+    for page_num in range(pages):
+        page_offset = page_num * page_length
+        content.append("".join(rng.choice("lorem ipsum dolor\n") for _ in range(page_length)))
+        page_objects.append(SimpleNamespace(spans=[SimpleNamespace(offset=page_offset, length=page_length)]))
+        cursor = page_offset
+        for _ in range(rng.randint(0, 3)):
+            start, length = cursor + rng.randint(0, 400), rng.randint(1, 300)
+            spans = [SimpleNamespace(offset=start, length=length)]
+            if rng.random() < 0.3:
+                spans.append(SimpleNamespace(offset=start + length + 5, length=10))
+            if spans[-1].offset + spans[-1].length > page_offset + page_length:
+                break
+            cells = [SimpleNamespace(row_index=row, column_index=column, kind=rng.choice(["content", "columnHeader"]),
+                                     column_span=1, row_span=1, content=f"r{row}c{column} & <x>")
+                     for row in range(4) for column in range(3)]
+            rng.shuffle(cells)
+            tables.append(SimpleNamespace(bounding_regions=[SimpleNamespace(page_number=page_num + 1)], spans=spans,
+                                          cells=cells, row_count=4))
+            cursor = spans[-1].offset + spans[-1].length + 5
+    return SimpleNamespace(content="".join(content), pages=page_objects, tables=tables)
+
+
+def char_by_char_pages(form_recognizer_results) -> list:
+    """The reconstruction the interval builder replaced: rescan all tables per page, mark table characters
+    one by one and build the page text a character at a time"""
+    page_map, offset = [], 0
+    for page_num, page in enumerate(form_recognizer_results.pages):
+        tables_on_page = [table for table in form_recognizer_results.tables if table.bounding_regions[0].page_number == page_num + 1]
+        page_offset, page_length = page.spans[0].offset, page.spans[0].length
+        table_chars = [-1] * page_length
+        for table_id, table in enumerate(tables_on_page):
+            for span in table.spans:
+                for i in range(span.length):
+                    idx = span.offset - page_offset + i
+                    if 0 <= idx < page_length:
+                        table_chars[idx] = table_id
+        page_text, added_tables = "", set()
+        for idx, table_id in enumerate(table_chars):
+            if table_id == -1:
+                page_text += form_recognizer_results.content[page_offset + idx]
+            elif table_id not in added_tables:
+                page_text += table_to_html(tables_on_page[table_id])
+                added_tables.add(table_id)
+        page_text += " "
+        page_map.append((page_num, offset, page_text))
+        offset += len(page_text)
+    return page_map
+
+
+def test_interval_builder_matches_char_by_char():
+    for seed in range(10):
+        result = synthetic_result(pages=20, seed=seed)
+        assert list(_iter_form_recognizer_pages(result)) == char_by_char_pages(result)
+
+
+def test_500_page_reconstruction_benchmark():
+    result = synthetic_result(pages=500)
+    interval_seconds = min(timeit.repeat(lambda: list(_iter_form_recognizer_pages(result)), number=1, repeat=3))
+    char_seconds = min(timeit.repeat(lambda: char_by_char_pages(result), number=1, repeat=3))
+    print(f"\n500 pages, {len(result.tables)} tables: interval builder {interval_seconds * 1000:.1f} ms, "
+          f"char by char {char_seconds * 1000:.1f} ms")
+    assert list(_iter_form_recognizer_pages(result)) == char_by_char_pages(result)
+    assert interval_seconds * 5 < char_seconds
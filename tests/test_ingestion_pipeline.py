@@ -0,0 +1,78 @@
+import asyncio
+from types import SimpleNamespace
+
+from common.ingestion import IngestionPipeline, page_chunks, page_doc_id
+from conftest import make_pdf, NamedBytesIO
+
+
+class RateLimitError(Exception):
+    """Shaped like openai.RateLimitError: a 429 whose response carries the Retry-After header"""
+    status_code = 429
+
+    def __init__(self):
+        super().__init__("Rate limit reached")
+        self.response = SimpleNamespace(status_code=429, headers={"retry-after": "0.01"})
+
+
+class FakeEmbedder:
+    """Async embedder that throttles any request with more than max_batch texts"""
+
+    def __init__(self, max_batch: int):
+        self.max_batch = max_batch
+        self.batches = []
+        self.throttles = 0
+
+    async def aembed_documents(self, texts):
+        await asyncio.sleep(0.002)
+        if len(texts) > self.max_batch:
+            self.throttles += 1
+            raise RateLimitError()
+        self.batches.append(len(texts))
+        return [[float(len(text)), 0.0, 1.0] for text in texts]
+
+
+def _grew_after_shrinking(sizes, initial):
+    """True if, after a batch smaller than half the initial size, a larger batch was accepted again"""
+    smallest = initial
+    for size in sizes:
+        if smallest <= initial // 2 and size > smallest:
+            return True
+        smallest = min(smallest, size)
+    return False
+
+
+def test_pipeline_adapts_to_throttling_and_indexes_everything(search_stub, search_client):
+    documents = {f"doc{i}.pdf": [(page, page * 100, f"text of page {page} of doc {i}") for page in range(50)]
+                 for i in range(60)}
+    documents["scanned.pdf"] = NamedBytesIO(make_pdf(5), "scanned.pdf")
+    expected = {page_doc_id(name, page) for name in documents for page in range(1, (5 if name == "scanned.pdf" else 50) + 1)}
+
+    embedder = FakeEmbedder(max_batch=20)
+    search_stub.max_batch["idx"] = 60
+    pipeline = IngestionPipeline("idx", embedder, client=search_client, chunker=page_chunks, base_url="https://blob/",
+                                 embed_workers=2, upload_workers=2, embed_batch_size=32, upload_batch_size=100,
+                                 queue_size=100)
+    # The stub answers Retry-After: 0, which leaves the wait to the exponential backoff
+    pipeline.embed_batch.backoff = pipeline.upload_batch.backoff = 0.01
+
+    async def run():
+        try:
+            return await pipeline.arun(documents)
+        finally:
+            await search_client.aclose()
+
+    stats = asyncio.run(run())
+
+    # Every page landed once, with its vector, and nothing was reported as failed
+    indexed = search_stub.documents["idx"]
+    assert set(indexed) == expected
+    assert all(len(doc["chunkVector"]) == 3 for doc in indexed.values())
+    assert stats["failed"] == 0
+    assert stats["stages"]["upload"]["items"] == len(expected)
+
+    # Both stages were throttled, shrank their batches below the limit and grew them again afterwards
+    assert stats["embed_throttles"] == embedder.throttles > 0
+    assert stats["upload_throttles"] > 0
+    assert max(embedder.batches) <= 20 and max(search_stub.batches["idx"]) <= 60
+    assert _grew_after_shrinking(embedder.batches, 32)
+    assert _grew_after_shrinking(search_stub.batches["idx"], 100)
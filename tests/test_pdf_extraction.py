@@ -0,0 +1,39 @@
+import pytest
+
+from common.utils import read_pdf_files, parse_pdf, extract_pdf_pages_parallel
+from common.extraction_cache import PdfExtractionCache
+from conftest import make_pdf, NamedBytesIO
+
+
+@pytest.fixture
+def uploads():
+    return [NamedBytesIO(make_pdf(3), "a.pdf"), NamedBytesIO(make_pdf(2, lines_per_page=5), "b.pdf")]
+
+
+def _expected_sources(*files_and_pages):
+    return [f"{name}_page_{page}" for name, pages in files_and_pages for page in range(1, pages + 1)]
+
+
+@pytest.mark.parametrize("max_workers", [None, 2])
+def test_read_pdf_files_keeps_input_order_and_duplicates(uploads, tmp_path, max_workers):
+    a, b = uploads
+    files = [a, b, a]
+    texts, sources = read_pdf_files(files, max_workers=max_workers)
+    assert sources == _expected_sources(("a.pdf", 3), ("b.pdf", 2), ("a.pdf", 3))
+    assert texts[:3] == texts[5:]
+
+    # Cached and freshly extracted files come back in the same positions
+    cache = PdfExtractionCache(str(tmp_path))
+    read_pdf_files([b], cache=cache)
+    assert read_pdf_files(files, max_workers=max_workers, cache=cache) == [texts, sources]
+
+
+def test_parallel_extraction_matches_serial(uploads, tmp_path):
+    # A long file split across several page-range tasks, a file shorter than one task, and in-memory uploads
+    long_path, short_path = tmp_path / "long.pdf", tmp_path / "short.pdf"
+    long_path.write_bytes(make_pdf(23))
+    short_path.write_bytes(make_pdf(2))
+    files = [str(long_path), uploads[0], str(short_path), uploads[1]]
+
+    serial = [parse_pdf(file) for file in files]
+    assert extract_pdf_pages_parallel(files, max_workers=2, pages_per_task=5) == serial
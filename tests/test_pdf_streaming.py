@@ -0,0 +1,61 @@
+import gc
+import tracemalloc
+
+import pytest
+
+from common.utils import iter_pdf_pages, parse_pdf
+from conftest import make_pdf
+
+
+def _growth_after_first_page(pages) -> tuple:
+    """Consumes a page iterator and returns (peak memory growth after the first page, characters extracted).
+    By the first page PyPDF has read the xref and indexed the page tree, which it needs whatever the consumer does.
+    Each page's text extraction leaves cyclic garbage, collected after every page so only live memory is measured."""
+    tracemalloc.start()
+    try:
+        pages = iter(pages)
+        characters = len(next(pages)[2])
+        baseline, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        for page_num, offset, page_text in pages:
+            characters += len(page_text)
+            gc.collect(1)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak - baseline, characters
+
+
+def _peak(consume) -> int:
+    tracemalloc.start()
+    try:
+        consume()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+@pytest.fixture(scope="module")
+def pdfs(tmp_path_factory):
+    paths = {}
+    for pages in (20, 160):
+        paths[pages] = tmp_path_factory.mktemp("pdfs") / f"{pages}.pdf"
+        paths[pages].write_bytes(make_pdf(pages, lines_per_page=20))
+    return paths
+
+
+def test_streaming_memory_stays_flat_with_document_size(pdfs):
+    small, _ = _growth_after_first_page(iter_pdf_pages(str(pdfs[20])))
+    large, characters = _growth_after_first_page(iter_pdf_pages(str(pdfs[160])))
+    print(f"\npeak growth: 20 pages {small // 1024} KiB, 160 pages {large // 1024} KiB, text {characters // 1024} KiB")
+    # 8x the pages costs about the same memory
+    assert large < 1.5 * small
+
+
+def test_page_map_holds_every_page(pdfs):
+    # The list API keeps all of the text alive until it returns, which is what the generator avoids
+    path = str(pdfs[160])
+    characters = sum(len(page_text) for _, _, page_text in iter_pdf_pages(path))
+    streaming = _peak(lambda: sum(len(page_text) for _, _, page_text in iter_pdf_pages(path)))
+    listed = _peak(lambda: parse_pdf(path))
+    assert listed > streaming + characters // 2
@@ -0,0 +1,36 @@
+import time
+import asyncio
+
+import pytest
+import requests
+
+
+def test_sync_retries_throttled_searches(search_stub, search_client):
+    search_stub.statuses["idx"] = [429, 503]
+    results = search_client.search("idx", {"search": "q"}, timeout=5)
+    assert len(results["value"]) == 5
+    assert search_stub.requests["idx"] == 3
+
+
+def test_sync_does_not_retry_timeouts(search_stub, search_client):
+    # A read timeout must surface after one attempt, or the per-index timeout is multiplied by the retries
+    search_stub.delays["slow"] = 1.5
+    start = time.monotonic()
+    with pytest.raises(requests.exceptions.RequestException):
+        search_client.search("slow", {"search": "q"}, timeout=0.3)
+    assert time.monotonic() - start < 1.0
+    assert search_stub.requests["slow"] == 1
+
+
+def test_async_retries_throttled_searches(search_stub, search_client):
+    search_stub.statuses["idx"] = [429]
+
+    async def run():
+        try:
+            return await search_client.asearch("idx", {"search": "q"}, timeout=5)
+        finally:
+            await search_client.aclose()
+
+    results = asyncio.run(run())
+    assert len(results["value"]) == 5
+    assert search_stub.requests["idx"] == 2
@@ -0,0 +1,60 @@
+import time
+import asyncio
+
+from common.utils import get_search_results, aget_search_results
+
+INDEXES = ["srch-index-files", "srch-index-csv", "srch-index-books"]
+DELAYS = {"srch-index-files": 0.3, "srch-index-csv": 0.5, "srch-index-books": 0.7}
+
+
+def test_fanout_latency_tracks_slowest_index(search_stub, search_client):
+    search_stub.delays.update(DELAYS)
+    start = time.monotonic()
+    results = get_search_results("q", INDEXES, k=10, client=search_client, timeout=5)
+    elapsed = time.monotonic() - start
+    # Sequential requests would take the sum (1.5 s); concurrent ones take about the max (0.7 s)
+    assert max(DELAYS.values()) <= elapsed < sum(DELAYS.values()) - 0.3
+    assert {value["index"] for value in results.values()} == set(INDEXES)
+
+
+def test_async_fanout_latency_tracks_slowest_index(search_stub, search_client):
+    search_stub.delays.update(DELAYS)
+
+    async def run():
+        try:
+            start = time.monotonic()
+            results = await aget_search_results("q", INDEXES, k=10, client=search_client, timeout=5)
+            return results, time.monotonic() - start
+        finally:
+            await search_client.aclose()
+
+    results, elapsed = asyncio.run(run())
+    assert max(DELAYS.values()) <= elapsed < sum(DELAYS.values()) - 0.3
+    assert {value["index"] for value in results.values()} == set(INDEXES)
+
+
+def test_slow_index_times_out_at_the_configured_bound(search_stub, search_client):
+    search_stub.delays.update({"srch-index-files": 0.1, "srch-index-books": 3})
+    start = time.monotonic()
+    results = get_search_results("q", ["srch-index-files", "srch-index-books"], k=10, client=search_client, timeout=0.5)
+    elapsed = time.monotonic() - start
+    assert elapsed < 1.2
+    assert {value["index"] for value in results.values()} == {"srch-index-files"}
+    assert search_stub.requests["srch-index-books"] == 1
+
+
+def test_async_slow_index_times_out_at_the_configured_bound(search_stub, search_client):
+    search_stub.delays.update({"srch-index-files": 0.1, "srch-index-books": 3})
+
+    async def run():
+        try:
+            start = time.monotonic()
+            results = await aget_search_results("q", ["srch-index-files", "srch-index-books"], k=10,
+                                                client=search_client, timeout=0.5)
+            return results, time.monotonic() - start
+        finally:
+            await search_client.aclose()
+
+    results, elapsed = asyncio.run(run())
+    assert elapsed < 1.2
+    assert {value["index"] for value in results.values()} == {"srch-index-files"}
@@ -0,0 +1,64 @@
+import random
+import timeit
+from collections import OrderedDict
+
+import pytest
+
+from common.utils import _TopKMerger
+
+INDEXES = [f"srch-index-{i}" for i in range(5)]
+
+
+def fake_responses(candidates: int, seed: int = 0) -> dict:
+    """Per-index responses sorted by reranker score, as the service returns them, with ids shared across indexes"""
+    rng = random.Random(seed)
+    responses = {}
+    for index in INDEXES:
+        ids = rng.sample(range(candidates * 3), candidates)
+        results = [{"id": f"doc-{doc_id}", "title": f"doc {doc_id}", "name": f"doc-{doc_id}.pdf", "chunk": "text",
+                    "location": "", "@search.rerankerScore": rng.uniform(0, 4),
+                    "@search.captions": [{"text": "caption"}]} for doc_id in ids]
+        responses[index] = {"value": sorted(results, key=lambda r: r["@search.rerankerScore"], reverse=True)}
+    return responses
+
+
+def full_sort_merge(responses: dict, k: int, reranker_threshold: float) -> OrderedDict:
+    """The merge the heap replaced: build every entry, dedupe keeping the max score, sort them all, keep k"""
+    content = {}
+    for index, search_results in responses.items():
+        for result in search_results["value"]:
+            score = result["@search.rerankerScore"]
+            if score > reranker_threshold and score > content.get(result["id"], {}).get("score", -1):
+                content[result["id"]] = {"title": result["title"], "name": result["name"], "chunk": result["chunk"],
+                                         "location": result["location"], "caption": result["@search.captions"][0]["text"],
+                                         "score": score, "index": index}
+    return OrderedDict((id, content[id]) for id in sorted(content, key=lambda x: content[x]["score"], reverse=True)[:k])
+
+
+def heap_merge(responses: dict, k: int, reranker_threshold: float) -> OrderedDict:
+    merger = _TopKMerger(k, reranker_threshold)
+    for position, (index, search_results) in enumerate(responses.items()):
+        merger.push(index, position, search_results)
+    return merger.results()
+
+
+@pytest.mark.parametrize("candidates", [10, 100, 1000])
+def test_heap_merge_matches_full_sort(candidates):
+    responses = fake_responses(candidates)
+    expected = full_sort_merge(responses, k=20, reranker_threshold=1)
+    merged = heap_merge(responses, k=20, reranker_threshold=1)
+    assert list(merged) == list(expected)
+    assert [entry["score"] for entry in merged.values()] == [entry["score"] for entry in expected.values()]
+
+
+@pytest.mark.parametrize("candidates", [10, 100, 1000])
+def test_heap_merge_benchmark(candidates):
+    responses = fake_responses(candidates)
+    number = max(1, 2000 // candidates)
+    timings = {name: min(timeit.repeat(lambda: merge(responses, 20, 1), number=number, repeat=5)) / number
+               for name, merge in (("full sort", full_sort_merge), ("heap", heap_merge))}
+    print(f"\n{candidates} candidates x {len(INDEXES)} indexes: "
+          + ", ".join(f"{name} {seconds * 1e6:.0f} us" for name, seconds in timings.items()))
+    if candidates >= 1000:
+        # Only the k best entries are ever built, so the heap pulls ahead as the candidate lists grow
+        assert timings["heap"] < timings["full sort"]